@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Synthetic, reproducible inputs for the benchmarks: MOSMIX KML/KMZ files, months of wetter.messung rows and a SQLite
+stand-in for the MariaDB schema wetter.
+"""
+
+import re
+import io
+import sqlite3
+import zipfile
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from src import schema
+
+# elements read by DwdForecastLoader with a plausible value range, further elements of the real products follow
+_ELEMENT_RANGES = {'TTT': (255., 305.), 'T5cm': (255., 310.), 'PPPP': (97000., 104000.), 'FX1': (0., 25.),
+                   'FF': (0., 15.), 'ww': (0., 95.), 'SunD1': (0., 3600.), 'Neff': (0., 100.), 'R101': (0., 100.),
+                   'RR1c': (0., 5.), 'Rad1h': (0., 3000.)}
+_OTHER_ELEMENTS = ['Td', 'TX', 'TN', 'DD', 'FX3', 'FXh', 'FXh25', 'FXh40', 'FXh55', 'N', 'Nh', 'Nm', 'Nl', 'N05', 'VV',
+                   'W1W2', 'wwM', 'wwM6', 'wwMh', 'wwP', 'wwZ', 'wwD', 'wwC', 'wwT', 'wwL', 'wwS', 'wwF', 'RR3c',
+                   'RRS1c', 'RRS3c', 'R102', 'R103', 'R105', 'R107', 'R110', 'R120', 'R130', 'R150', 'SunD3', 'SunD',
+                   'RSunD', 'PSd00', 'PSd30', 'PSd60', 'Rh00', 'Rh02', 'Rh10', 'Rh25', 'Rh50', 'DRR1', 'E_TTT',
+                   'E_Td', 'E_FF', 'E_DD', 'E_PPP']
+# (number of elements, number of hourly time steps) of the dwd products
+PRODUCTS = {'L': (115, 247), 'S': (40, 240)}
+
+
+def mosmix_kml(stations: list, product: str = 'L', issue_time: pd.Timestamp = None, missing: float = 0.02,
+               seed: int = 0) -> bytes:
+    """
+    Builds a MOSMIX KML document in the layout published by dwd (one Placemark per station).
+
+    :param stations: station ids
+    :param product: 'L' or 'S', sets the number of elements and time steps
+    :param issue_time: issue time (UTC), default: the current hour
+    :param missing: share of missing values ('-')
+    :param seed: random seed
+    :return: latin-1 encoded KML
+    """
+    rng = np.random.default_rng(seed)
+    n_elements, n_steps = PRODUCTS[product]
+    issue_time = issue_time if issue_time is not None else pd.Timestamp.now(tz='UTC').floor('h')
+    steps = pd.date_range(issue_time + pd.Timedelta(hours=1), periods=n_steps, freq='h')
+    elements = dict(_ELEMENT_RANGES)
+    for name in _OTHER_ELEMENTS + [f'X{i:03d}' for i in range(n_elements)]:
+        if len(elements) >= n_elements:
+            break
+        elements[name] = (0., 100.)
+
+    placemarks = []
+    for station_id in stations:
+        forecasts = []
+        for element, (low, high) in elements.items():
+            values = rng.uniform(low, high, n_steps)
+            values = np.char.mod('%.2f', np.floor(values) if element == 'ww' else values)
+            values[rng.random(n_steps) < missing] = '-'
+            forecasts.append(f'<dwd:Forecast dwd:elementName="{element}"><dwd:value>'
+                             f'{"".join(np.char.rjust(values, 11))}</dwd:value></dwd:Forecast>')
+        placemarks.append(f'<kml:Placemark><kml:name>{station_id}</kml:name>'
+                          f'<kml:description>STATION {station_id}</kml:description>'
+                          f'<kml:ExtendedData>{"".join(forecasts)}</kml:ExtendedData>'
+                          f'<kml:Point><kml:coordinates>11.6,48.1,520.0</kml:coordinates></kml:Point>'
+                          f'</kml:Placemark>')
+    time_steps = ''.join(f'<dwd:TimeStep>{ts:%Y-%m-%dT%H:%M:%S}.000Z</dwd:TimeStep>' for ts in steps)
+    return (f'<?xml version="1.0" encoding="ISO-8859-1" standalone="yes"?>\n'
+            f'<kml:kml xmlns:dwd="https://opendata.dwd.de/weather/lib/pointforecast_dwd_extension_V1_0.xsd" '
+            f'xmlns:kml="http://www.opengis.net/kml/2.2"><kml:Document><kml:ExtendedData><dwd:ProductDefinition>'
+            f'<dwd:Issuer>Deutscher Wetterdienst</dwd:Issuer><dwd:ProductID>MOSMIX</dwd:ProductID>'
+            f'<dwd:GeneratingProcess>DWD MOSMIX hourly, Version 1.0</dwd:GeneratingProcess>'
+            f'<dwd:IssueTime>{issue_time:%Y-%m-%dT%H:%M:%S}.000Z</dwd:IssueTime>'
+            f'<dwd:ForecastTimeSteps>{time_steps}</dwd:ForecastTimeSteps></dwd:ProductDefinition></kml:ExtendedData>'
+            f'{"".join(placemarks)}</kml:Document></kml:kml>').encode('latin-1')
+
+
+def mosmix_kmz(stations: list, product: str = 'L', **kwargs) -> bytes:
+    """
+    :return: the KML of mosmix_kml zipped like the files on opendata.dwd.de
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as kmz:
+        kmz.writestr(f'MOSMIX_{product}_{"_".join(stations[:1])}.kml', mosmix_kml(stations, product, **kwargs))
+    return buffer.getvalue()
+
+
+def messung_frame(days: float = 90, interval_s: int = 60, end: pd.Timestamp = None, seed: int = 0) -> pd.DataFrame:
+    """
+    Synthetic raw measurements with a daily temperature cycle, a random walk pressure and day light.
+
+    :param days: covered time span
+    :param interval_s: seconds between two samples
+    :param end: last sample, default now
+    :param seed: random seed
+    :return: frame with columns zeit, temperature, pressure, hell
+    """
+    rng = np.random.default_rng(seed)
+    end = (end if end is not None else pd.Timestamp.now()).floor('s')
+    zeit = pd.date_range(end=end, periods=int(days * 86400 / interval_s), freq=f'{interval_s}s')
+    hour = zeit.hour + zeit.minute / 60
+    return pd.DataFrame({'zeit': zeit,
+                         'temperature': np.round(10 - 6 * np.cos(2 * np.pi * hour / 24)
+                                                 + rng.normal(0, .3, len(zeit)), 2),
+                         'pressure': np.round(960 + np.cumsum(rng.normal(0, .02, len(zeit))), 2),
+                         'hell': ((hour > 7) & (hour < 19)).astype(int)})
+
+
+def ww_codes_frame() -> pd.DataFrame:
+    """
+    :return: significant weather codes 0..99 indexed by id, like wetter.ww_codes
+    """
+    return pd.DataFrame({'id': range(100), 'beschreibung': [f'ww {i}' for i in range(100)]}).set_index('id')
+
+
+class StaticFetcher:
+    """
+    Stands in for CachedFetcher and returns the same body for every url.
+    """
+    def __init__(self, body: bytes):
+        self._body = body
+
+    def fetch(self, url: str, force: bool = False) -> bytes:
+        return self._body
+
+    def mark_processed(self, url: str) -> None:
+        pass
+
+    def encoding(self, url: str) -> None:
+        return None
+
+
+_ON_DUPLICATE = re.compile(r'ON DUPLICATE KEY UPDATE', re.IGNORECASE)
+_VALUES_REF = re.compile(r'VALUES\((\w+)\)')
+_INSERT_TABLE = re.compile(r'INSERT INTO wetter\.(\w+)', re.IGNORECASE)
+# unique keys the upserts rely on (SQLite < 3.35 needs them spelled out), tables not listed are rollup tiers
+_CONFLICT_TARGETS = {'forecast_dwd': '(station_id, ts)', 'forecast_dwd_issue': '(station_id, issue_time)',
+                     'rollup_state': '(name)', 'data_generation': '(name)', 'verification_state': '(name)',
+                     'forecast_skill': '(station_id, variable, lead_h, issue_hour)',
+                     'forecast_skill_daily': '(day, station_id, variable)'}
+_INSERT_IGNORE = re.compile(r'INSERT IGNORE', re.IGNORECASE)
+_CREATE_INDEX = re.compile(r'CREATE (UNIQUE )?INDEX IF NOT EXISTS (\w+) ON wetter\.(\w+)', re.IGNORECASE)
+
+
+def _translate(sql: str) -> str:
+    """
+    Rewrites the MariaDB upsert / insert ignore / create index syntax used by the repository into SQLite.
+    """
+    sql = _INSERT_IGNORE.sub('INSERT OR IGNORE', sql)
+    sql = _CREATE_INDEX.sub(r'CREATE \1INDEX IF NOT EXISTS wetter.\2 ON \3', sql)
+    if not _ON_DUPLICATE.search(sql):
+        return sql
+    head, tail = _ON_DUPLICATE.split(sql, maxsplit=1)
+    target = _CONFLICT_TARGETS.get(_INSERT_TABLE.search(head).group(1), '(bucket)')
+    return f'{head} ON CONFLICT {target} DO UPDATE SET ' + _VALUES_REF.sub(r'excluded.\1', tail)
+
+
+class _Cursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        return super().execute(_translate(sql), parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return super().executemany(_translate(sql), seq_of_parameters)
+
+
+class StandInConnection(sqlite3.Connection):
+    """
+    sqlite3 connection which accepts the MariaDB statements of this repository (schema wetter, ? placeholders,
+    ON DUPLICATE KEY UPDATE), so loaders and rollups can be benchmarked without a server.
+    """
+    def cursor(self, factory=_Cursor):
+        return super().cursor(factory)
+
+
+sqlite3.register_adapter(datetime, lambda ts: ts.strftime('%Y-%m-%d %H:%M:%S'))
+sqlite3.register_adapter(pd.Timestamp, lambda ts: ts.strftime('%Y-%m-%d %H:%M:%S'))
+sqlite3.register_converter('DATETIME', lambda b: datetime.fromisoformat(b.decode()))
+
+
+def standin_db() -> StandInConnection:
+    """
+    Creates the tables of schema wetter used by the loaders in an in-memory SQLite database and applies the
+    migrations of src/schema.py.
+
+    :return: connection
+    """
+    con = sqlite3.connect(':memory:', factory=StandInConnection, detect_types=sqlite3.PARSE_DECLTYPES,
+                          check_same_thread=False)
+    con.execute("ATTACH DATABASE ':memory:' AS wetter")
+    con.executescript("""
+        CREATE TABLE IF NOT EXISTS wetter.messung (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            zeit DATETIME, temperature FLOAT, pressure FLOAT, hell INT);
+        CREATE TABLE IF NOT EXISTS wetter.forecast_dwd (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts DATETIME, station_id VARCHAR(8), last_update DATETIME,
+            temperatur FLOAT, druck FLOAT, wind_max_1h FLOAT, ww INT, sonnenscheinminuten FLOAT, wolken FLOAT,
+            p_regen FLOAT, niederschlag_1h FLOAT, wind FLOAT, temperatur_boden FLOAT, sonnenstrahlung FLOAT);
+        CREATE TABLE IF NOT EXISTS wetter.forecast_text (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts DATETIME, forecast INT, fc_text TEXT);
+        """)
+    schema.migrate(con, force=True)  # every stand-in is a new database
+    return con
+
+
+def insert_messung(con: StandInConnection, df: pd.DataFrame) -> None:
+    """
+    Bulk inserts raw measurements (as returned by messung_frame) into wetter.messung.
+    """
+    rows = df[['zeit', 'temperature', 'pressure', 'hell']].astype(object)
+    rows['zeit'] = df['zeit'].dt.strftime('%Y-%m-%d %H:%M:%S')
+    con.executemany('INSERT INTO wetter.messung (zeit, temperature, pressure, hell) VALUES (?, ?, ?, ?)',
+                    rows.itertuples(index=False, name=None))
+    con.commit()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Measures the import cost of the cron entry points (and of the heavy libraries they defer) in fresh interpreters.
+
+Run from the repository root on the Pi:  python3 benchmarks/startup.py [-n 5]
+"""
+
+import os
+import re
+import sys
+import argparse
+import statistics
+import subprocess
+
+ENTRY_POINTS = ['forecast_loader_dwd', 'get_weather_text_to_db', 'temperature_pressure_db', 'weather_graph',
+                'rollup_maintenance']
+LIBRARIES = ['pandas', 'numpy', 'matplotlib.pyplot', 'lxml.etree', 'lxml.html', 'requests', 'mariadb']
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)')
+
+
+def import_time(module: str) -> (float, list):
+    """
+    Imports module in a new interpreter with -X importtime.
+
+    :param module: module name
+    :return: tuple (total cumulative import time in ms, list of (cumulative ms, module) of the top-level imports)
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    top = []
+    for line in proc.stderr.splitlines():
+        match = _LINE.match(line)
+        if match and len(match.group(3)) == 1:  # one blank: imported directly by the -c statement
+            top.append((int(match.group(2)) / 1000, match.group(4)))
+    return sum(ms for ms, _ in top), top
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-n', type=int, default=5, help='runs per module, the median is reported')
+    parser.add_argument('--top', type=int, default=5, help='slowest imports shown per entry point')
+    args = parser.parse_args()
+
+    for title, modules in (('entry points', ENTRY_POINTS), ('deferred libraries', LIBRARIES)):
+        print(f'\n{title}:')
+        for module in modules:
+            try:
+                runs = [import_time(module) for _ in range(args.n)]
+            except RuntimeError as e:
+                print(f'  {module:<26} failed: {e}')
+                continue
+            total = statistics.median(ms for ms, _ in runs)
+            print(f'  {module:<26} {total:8.1f} ms')
+            if module in ENTRY_POINTS:
+                for ms, name in sorted(runs[-1][1], reverse=True)[:args.top]:
+                    print(f'      {ms:8.1f} ms  {name}')
+
+
+if __name__ == '__main__':
+    main()
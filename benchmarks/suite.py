@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark suite for the forecast parser, the DB writes, the rollups and the graphs on synthetic data.
+
+Run from the repository root on the Pi:  python3 benchmarks/suite.py [-n 5] [--only parse]
+Every run is appended to benchmarks/results.jsonl (commit, host, parameters, timings and peak memory, not tracked by
+git) and compared with the previous run of the same host and parameters. The peak memory is the python heap traced by
+tracemalloc, allocations of C libraries (lxml, numpy buffers outside python's allocator) are not included.
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+from datetime import datetime
+from functools import cached_property
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks import fixtures  # noqa: E402
+
+RESULTS_PATH = os.path.join(ROOT, 'benchmarks', 'results.jsonl')
+STATIONS = ['N2147', 'P830', '10865']
+
+
+class Case:
+    """
+    One benchmark: run is timed, setup (if given) is called untimed before every repetition.
+    """
+    def __init__(self, run, setup=None, items: int = None):
+        """
+        :param run: callable without arguments (gets the result of setup if setup is given)
+        :param setup: callable preparing a fresh state for each repetition
+        :param items: number of processed items (rows, stations, ...) used to report a throughput
+        """
+        self.run = run
+        self.setup = setup
+        self.items = items
+
+    def once(self) -> float:
+        state = self.setup() if self.setup is not None else None
+        start = time.perf_counter()
+        self.run() if self.setup is None else self.run(state)
+        return time.perf_counter() - start
+
+
+class Fixtures:
+    """
+    Inputs shared by the benchmarks, built on first use.
+    """
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.tmp = tempfile.mkdtemp(prefix='wetter_bench_')
+
+    @cached_property
+    def kml_l(self) -> bytes:
+        return fixtures.mosmix_kml(['P830'], 'L')
+
+    @cached_property
+    def kmz_l(self) -> bytes:
+        return fixtures.mosmix_kmz(['P830'], 'L')
+
+    @cached_property
+    def kml_s_all(self) -> bytes:
+        return fixtures.mosmix_kml([f'S{i:04d}' for i in range(self.args.stations)], 'S')
+
+    @cached_property
+    def forecasts(self) -> dict:
+        from src.dwd_forecast import DwdForecastLoader
+        return {station_id: DwdForecastLoader(None, fixtures.StaticFetcher(fixtures.mosmix_kmz([station_id], 'L',
+                                                                                                seed=i)))
+                .fetch(station_id) for i, station_id in enumerate(STATIONS)}
+
+    @cached_property
+    def messung(self):
+        return fixtures.messung_frame(days=self.args.days)
+
+    def messung_db(self) -> 'fixtures.StandInConnection':
+        con = fixtures.standin_db()
+        fixtures.insert_messung(con, self.messung)
+        return con
+
+    @cached_property
+    def graph_inputs(self) -> tuple:
+        """
+        :return: tuple (3 days of 30 min measurements, raw forecast of all stations, ww codes) like load_data
+        """
+        import pandas as pd
+        from src.rollup import Rollup
+        from src.dtypes import FORECAST, compact
+        from src.dwd_forecast import DwdForecastLoader
+
+        con = fixtures.standin_db()
+        fixtures.insert_messung(con, self.messung.loc[self.messung['zeit'] >= self.messung['zeit'].max()
+                                                      - pd.Timedelta(days=3)])
+        rollup = Rollup(con, 'messung_30min', '30min')
+        rollup.refresh()
+        df_mess = rollup.load(since=datetime.now() - pd.Timedelta(days=3))
+
+        loader = DwdForecastLoader(con, fixtures.StaticFetcher(b''))
+        for station_id, df in self.forecasts.items():
+            loader._station_id, loader._df = station_id, df
+            loader._write_to_db()
+        df_raw = pd.read_sql(con=con, sql="""
+            select id, ts, station_id, last_update,
+                   temperatur, druck, sonnenscheinminuten, wind_max_1h, wind, niederschlag_1h, p_regen, ww
+            from wetter.forecast_dwd""", index_col='id')
+        return df_mess, compact(df_raw, FORECAST), fixtures.ww_codes_frame()
+
+
+def benchmarks(fx: Fixtures) -> dict:
+    """
+    :return: dict name -> function returning the Case (so fixtures are only built for selected benchmarks)
+    """
+    from src.dwd_forecast import DwdForecastLoader
+    from src.measurement_buffer import MeasurementBuffer
+    from src.rollup import refresh_all
+
+    def parse_mosmix_l():
+        return Case(lambda: DwdForecastLoader._return_fc_df(io.BytesIO(fx.kml_l)), items=1)
+
+    def parse_mosmix_s_all():
+        return Case(lambda: DwdForecastLoader._return_fc_df(io.BytesIO(fx.kml_s_all)), items=fx.args.stations)
+
+    def parse_bulk_select():
+        station_ids = [f'S{i:04d}' for i in range(0, fx.args.stations, 5)]
+        return Case(lambda: DwdForecastLoader._return_fc_dfs(io.BytesIO(fx.kml_s_all), station_ids),
+                    items=len(station_ids))
+
+    def fetch_kmz_l():
+        loader = DwdForecastLoader(None, fixtures.StaticFetcher(fx.kmz_l))
+        return Case(lambda: loader.fetch('P830'), items=1)
+
+    def write_forecast():
+        forecasts = fx.forecasts
+
+        def run(con):
+            loader = DwdForecastLoader(con, fixtures.StaticFetcher(b''))
+            for station_id, df in forecasts.items():
+                loader._station_id, loader._df = station_id, df
+                loader._write_to_db()
+        return Case(run, setup=fixtures.standin_db, items=sum(len(df) for df in forecasts.values()))
+
+    def upsert_forecast():
+        forecasts = fx.forecasts
+
+        def setup():
+            con = fixtures.standin_db()
+            run(con)  # the timed run updates existing rows
+            return con
+
+        def run(con):
+            loader = DwdForecastLoader(con, fixtures.StaticFetcher(b''))
+            for station_id, df in forecasts.items():
+                loader._station_id, loader._df = station_id, df
+                loader._write_to_db()
+        return Case(run, setup=setup, items=sum(len(df) for df in forecasts.values()))
+
+    def write_bulk():
+        station_ids = [f'S{i:04d}' for i in range(0, fx.args.stations, 5)]
+        dfs, _ = DwdForecastLoader._return_fc_dfs(io.BytesIO(fx.kml_s_all), station_ids)
+
+        def run(con):
+            DwdForecastLoader(con, fixtures.StaticFetcher(b''))._write_frames(dfs, None)
+        return Case(run, setup=fixtures.standin_db, items=sum(len(df) for df in dfs.values()))
+
+    def buffer_flush():
+        samples = fx.messung.tail(fx.args.samples)
+
+        def setup():
+            buffer = MeasurementBuffer(os.path.join(tempfile.mkdtemp(dir=fx.tmp), 'buffer.sqlite'))
+            for zeit, temperature, pressure, hell in samples.itertuples(index=False, name=None):
+                buffer.append(zeit.to_pydatetime(), hell, temperature, pressure)
+            return buffer, fixtures.standin_db()
+        return Case(lambda state: state[0].flush_all(state[1]), setup=setup, items=len(samples))
+
+    def rollup_refresh_all():
+        return Case(refresh_all, setup=fx.messung_db, items=len(fx.messung))
+
+    def blend_forecast():
+        from src.blend import Blender
+        forecasts = fx.forecasts
+
+        def setup():
+            con = fixtures.standin_db()
+            loader = DwdForecastLoader(con, fixtures.StaticFetcher(b''))
+            for station_id, df in forecasts.items():
+                loader._station_id, loader._df = station_id, df
+                loader._write_to_db()
+            return con
+        return Case(lambda con: Blender(con, list(forecasts)).run(), setup=setup,
+                    items=sum(len(df) for df in forecasts.values()))
+
+    def forecast_data():
+        from weather_graph import ForecastData
+        _, df_raw, df_ww = fx.graph_inputs
+
+        def run():
+            fc_data = ForecastData(df_raw, df_ww)
+            return fc_data.mean, fc_data.ww
+        return Case(run, items=len(df_raw))
+
+    def _prepared_forecast():
+        from weather_graph import ForecastData
+        _, df_raw, df_ww = fx.graph_inputs
+        fc_data = ForecastData(df_raw, df_ww)
+        _ = fc_data.mean, fc_data.ww
+        return fc_data
+
+    def preprocess_graph():
+        from weather_graph import preprocess_graph as preprocess
+        return Case(lambda fc_data: preprocess(fx.graph_inputs[0], fc_data), setup=_prepared_forecast)
+
+    def preprocess_fc():
+        from weather_graph import preprocess_fc as preprocess
+        return Case(preprocess, setup=_prepared_forecast)
+
+    def draw_graph():
+        from weather_graph import draw_graph as draw
+        path = os.path.join(fx.tmp, 'graph.jpg')
+        return Case(lambda fc_data: draw(fx.graph_inputs[0], fc_data, path), setup=_prepared_forecast)
+
+    def draw_fc():
+        from weather_graph import draw_fc as draw
+        path = os.path.join(fx.tmp, 'fc.jpg')
+        return Case(lambda fc_data: draw(fc_data, path), setup=_prepared_forecast)
+
+    def export_web():
+        from weather_graph import export_web as export
+
+        def setup():
+            directory = tempfile.mkdtemp(dir=fx.tmp)  # empty, so the payload is always written
+            return _prepared_forecast(), directory
+        return Case(lambda state: export(fx.graph_inputs[0], *state), setup=setup)
+
+    return {f.__name__: f for f in (parse_mosmix_l, parse_mosmix_s_all, parse_bulk_select, fetch_kmz_l,
+                                    write_forecast, upsert_forecast, write_bulk, buffer_flush, rollup_refresh_all,
+                                    blend_forecast, forecast_data, preprocess_graph, preprocess_fc, draw_graph, draw_fc,
+                                    export_web)}
+
+
+def measure(case: Case, n: int) -> dict:
+    """
+    Times n repetitions and traces the peak python heap of one more.
+
+    :return: dict with median_s, min_s, peak_mib (python heap only, see tracemalloc) and items
+    """
+    case.once()  # warm up: lazy imports, caches
+    times = [case.once() for _ in range(n)]
+    state = case.setup() if case.setup is not None else None
+    tracemalloc.start()
+    try:
+        case.run() if case.setup is None else case.run(state)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'median_s': round(statistics.median(times), 5), 'min_s': round(min(times), 5),
+            'peak_mib': round(peak / 2 ** 20, 2), 'items': case.items}
+
+
+def _git(*args) -> str:
+    proc = subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True)
+    return proc.stdout.strip() if proc.returncode == 0 else ''
+
+
+def _previous(path: str, host: str, params: dict) -> dict:
+    """
+    :return: results of the last run with the same host and parameters, empty if there is none
+    """
+    previous = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry.get('host') == host and entry.get('params') == params:
+                    previous = entry
+    return previous
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-n', type=int, default=5, help='timed repetitions per benchmark, the median is reported')
+    parser.add_argument('--only', nargs='*', default=[], help='run benchmarks whose name contains one of these')
+    parser.add_argument('--stations', type=int, default=100, help='stations in the synthetic MOSMIX_S file')
+    parser.add_argument('--days', type=float, default=90, help='days of synthetic 1 min measurements')
+    parser.add_argument('--samples', type=int, default=1000, help='samples per measurement buffer flush')
+    parser.add_argument('--results', default=RESULTS_PATH, help='jsonl file the results are appended to')
+    parser.add_argument('--no-save', action='store_true', help='do not append the results')
+    args = parser.parse_args()
+
+    fx = Fixtures(args)
+    params = {'n': args.n, 'stations': args.stations, 'days': args.days, 'samples': args.samples}
+    host = platform.node()
+    previous = _previous(args.results, host, params).get('results', {})
+
+    results = {}
+    print(f'{"benchmark":<22} {"median":>10} {"min":>10} {"py heap":>10} {"items/s":>10}  vs. last run')
+    for name, case in benchmarks(fx).items():
+        if args.only and not any(part in name for part in args.only):
+            continue
+        results[name] = result = measure(case(), args.n)
+        rate = f'{result["items"] / result["median_s"]:10.0f}' if result['items'] else f'{"":>10}'
+        before = previous.get(name, {}).get('median_s')
+        delta = f'{100 * (result["median_s"] / before - 1):+.1f} %' if before else ''
+        print(f'{name:<22} {result["median_s"]:9.4f}s {result["min_s"]:9.4f}s {result["peak_mib"]:7.1f}MiB '
+              f'{rate}  {delta}')
+
+    if args.no_save:
+        return
+    entry = {'date': datetime.now().isoformat(timespec='seconds'),
+             'commit': _git('rev-parse', '--short', 'HEAD') + ('-dirty' if _git('status', '--porcelain', '-uno')
+                                                                else ''),
+             'subject': _git('log', '-1', '--format=%s'),
+             'host': host,
+             'machine': platform.machine(),
+             'python': platform.python_version(),
+             'params': params,
+             'results': results}
+    with open(args.results, 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+    print(f'results appended to {args.results}')
+
+
+if __name__ == '__main__':
+    main()
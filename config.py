@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Settings of the weather station scripts which are no secrets (credentials stay in public_passwords).
+"""
+
+import os
+
+# dwd MOSMIX stations loaded by forecast_loader_dwd.py
+DWD_STATION_IDS = ['N2147', 'P830', '10865']
+# number of forecasts downloaded and parsed concurrently
+DWD_FETCH_WORKERS = 4
+# 'single_stations': one MOSMIX_L download per station, 'all_stations': all stations are read from one multi-station
+# file (url or local KMZ/KML path) in a single pass, which scales to a whole region
+DWD_MODE = 'single_stations'
+DWD_BULK_SOURCE = ('https://opendata.dwd.de/weather/local_forecasts/mos/MOSMIX_S/all_stations/kml/'
+                   'MOSMIX_S_LATEST_240.kmz')
+# get_weather_text_to_db.py: also store every new text forecast as a whole in wetter.forecast_text (next to the
+# deduplicated sections), for readers of that table
+TEXT_KEEP_FULL = True
+# ETag/Last-Modified headers and content hashes of the downloaded dwd files, unchanged sources are skipped
+HTTP_CACHE_DIR = '/home/pi/cache/dwd'
+# temperature_pressure_db.py --daemon: seconds between two samples and samples written per transaction
+SENSOR_INTERVAL_S = 10
+SENSOR_BATCH_SIZE = 30
+# samples per reading (combined to their median after outlier rejection) and seconds a stuck sensor is retried with
+# growing waits before the reading is given up
+SENSOR_BURST = 5
+SENSOR_RETRY_DEADLINE_S = 3.
+# BMP280: oversampling of temperature and pressure (1, 2, 4, 8 or 16), IIR filter coefficient (0: off, 2, 4, 8 or 16)
+# and mode, 'forced' (one conversion per read, the sensor sleeps in between) or 'normal' (continuous conversions every
+# BMP280_STANDBY_MS, for short sampling intervals)
+BMP280_OVERSAMPLING_T = 2
+BMP280_OVERSAMPLING_P = 16
+BMP280_IIR_FILTER = 4
+BMP280_MODE = 'forced'
+BMP280_STANDBY_MS = 62.5
+# local SQLite buffer every measurement is written to before it is bulk-loaded into wetter.messung
+MEASUREMENT_BUFFER_PATH = '/home/pi/data/messung_buffer.sqlite'
+# rollup_maintenance.py: days of raw wetter.messung rows kept, days kept per rollup tier (tiers not listed are kept
+# forever) and directory for gzip csv archives of removed raw rows (None: no archive)
+RAW_RETENTION_DAYS = 30
+TIER_RETENTION_DAYS = {'messung_1min': 400}
+ARCHIVE_DIR = '/home/pi/data/archive'
+# weather_graph.py: number of processes rendering the images in parallel (1: sequential, reusing figures)
+RENDER_WORKERS = 2
+# weather_graph.py output: 'images' (jpeg plots), 'web' (gzip JSON payload plus a static page in WEB_EXPORT_DIR,
+# the charts are drawn by the browser) or 'both'
+GRAPH_OUTPUT = 'images'
+WEB_EXPORT_DIR = '/var/www/html/wetter'
+# verify_forecast.py: time zone of the measurement timestamps (forecasts are stored in UTC), hours an hour is left
+# open for late measurements before it is verified and days verified by the first run
+LOCAL_TZ = 'Europe/Berlin'
+VERIFY_DELAY_H = 3
+VERIFY_BACKFILL_DAYS = 30
+# forecast_loader_dwd.py: days of verification used for the bias correction and the weights of the blended forecast
+# and distinct verified hours (within these days) a station needs to be corrected
+BLEND_WINDOW_DAYS = 14
+BLEND_MIN_HOURS = 48
+# csv copy of the static table wetter.ww_codes and seconds after which it is read from the DB again
+WW_CODES_CACHE_PATH = '/home/pi/cache/ww_codes.csv'
+WW_CODES_MAX_AGE_S = 7 * 24 * 60 * 60
+# scheduler.py: seconds between job runs (None: only when triggered by a predecessor with new data), number of jobs
+# running concurrently, size of the shared MariaDB connection pool and json file with the last run of each job
+JOB_INTERVALS_S = {'sample': SENSOR_INTERVAL_S,
+                   'flush_measurements': 60,
+                   'forecast': 15 * 60,
+                   'text_forecast': 15 * 60,
+                   'graph': 5 * 60,
+                   'rollup_maintenance': 60 * 60,
+                   'verification': 60 * 60}
+# seconds after the scheduler start until the first run of each job (default 0), so the jobs do not all start at
+# once: the buffered samples are flushed first, the rollup tiers are refreshed by one job before the next one reads
+# them and the graphs are drawn once forecast and measurements are in
+JOB_START_DELAYS_S = {'forecast': 15,
+                      'text_forecast': 45,
+                      'rollup_maintenance': 90,
+                      'graph': 150,
+                      'verification': 240}
+SCHEDULER_WORKERS = 4
+DB_POOL_SIZE = 4
+SCHEDULER_STATUS_PATH = '/home/pi/logs/scheduler_status.json'
+# timings and counters of all scripts in the Prometheus text format: directory of the node_exporter textfile
+# collector (None: not written) and (host, port) of the scheduler's /metrics endpoint (None: not served)
+METRICS_DIR = '/home/pi/metrics'
+METRICS_HTTP = None  # e.g. ('127.0.0.1', 9108)
+# weather_api.py: (host, port) of the JSON/CSV query API (e.g. ('0.0.0.0', 8081) to serve the local network),
+# pooled DB connections, number of cached responses and seconds a cached response is served at most (new data of
+# the loaders invalidates it earlier) and the largest accepted number of rows per response
+API_HTTP = ('127.0.0.1', 8081)
+API_POOL_SIZE = 2
+API_CACHE_ENTRIES = 128
+API_CACHE_TTL_S = 5 * 60
+API_MAX_ROWS = 50000
+# directory for cProfile dumps of every script / job run, switched on without editing this file by
+# WETTER_PROFILE_DIR=/home/pi/profiles python3 weather_graph.py (None: no profiling)
+PROFILE_DIR = os.environ.get('WETTER_PROFILE_DIR')
@@ -1,15 +1,42 @@
 #!/usr/bin/env python3
 
 import sys
+import argparse
 import mariadb
 import logging
 
-from src.dwd import DwdForecastLoader
+from src.dwd_forecast import DwdForecastLoader
+from src.blend import Blender
+from src.http_cache import CachedFetcher
+from src.metrics import METRICS, profiled
 
+import config as cfg
 import public_passwords as pw
 
 
+def run(con: 'mariadb.connection', source: str = None) -> bool:
+    """
+    Loads the forecasts of all configured stations into the DB and blends the new issues.
+    :param con: DB connection
+    :param source: url or local path of a multi-station KMZ/KML file, overrides DWD_MODE / DWD_BULK_SOURCE
+    :return: True if a new forecast was written for at least one station
+    """
+    dwd_fc_loader = DwdForecastLoader(con, CachedFetcher(cfg.HTTP_CACHE_DIR))
+    logging.info(f'Getting and storing {", ".join(cfg.DWD_STATION_IDS)}')
+    if source is not None or cfg.DWD_MODE == 'all_stations':
+        written = dwd_fc_loader.execute_bulk(cfg.DWD_STATION_IDS, source or cfg.DWD_BULK_SOURCE)
+    else:
+        written = dwd_fc_loader.execute_many(cfg.DWD_STATION_IDS, workers=cfg.DWD_FETCH_WORKERS)
+    # also after an unchanged download: catches up on issues a failed blend left behind
+    Blender(con, cfg.DWD_STATION_IDS, cfg.BLEND_WINDOW_DAYS, cfg.BLEND_MIN_HOURS).run()
+    return written > 0
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Loads the dwd MOSMIX forecasts of the configured stations.')
+    parser.add_argument('--file', help='local multi-station KMZ/KML file instead of the download')
+    args = parser.parse_args()
+
     logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
                         filename='/home/pi/logs/db_dwd_wetter_fc.log',
                         level=logging.INFO)
@@ -24,11 +51,9 @@ if __name__ == '__main__':
         sys.exit(1)
     logging.info('connected to MariaDB - wetter')
 
-    dwd_fc_loader = DwdForecastLoader(con)
-
-    for station_id in ['N2147', 'P830', '10865']:
-        logging.info(f'Getting and storing {station_id}')
-        dwd_fc_loader.execute(station_id)
+    with profiled('forecast_loader_dwd', cfg.PROFILE_DIR):
+        run(con, args.file)
+    METRICS.write_textfile(cfg.METRICS_DIR, 'forecast_loader_dwd')
 
     con.close()
     logging.info('done')
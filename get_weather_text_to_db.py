@@ -4,10 +4,24 @@ import mariadb
 import sys
 import logging
 
-from src.dwd import TextToDB
+from src.dwd_text import TextToDB
+from src.http_cache import CachedFetcher
+from src.metrics import METRICS, profiled
 
+import config as cfg
 import public_passwords as pw
 
+URL = 'http://141.38.2.26/weather/text_forecasts/html/VHDL50_DWMG_LATEST_html'
+
+
+def run(con: 'mariadb.connection') -> bool:
+    """
+    Loads the text forecast into the DB, the connection stays open (it is owned by the caller).
+    :param con: DB connection
+    :return: True if a new text was written
+    """
+    return TextToDB(con, URL, CachedFetcher(cfg.HTTP_CACHE_DIR), keep_full_text=cfg.TEXT_KEEP_FULL).run()
+
 
 if __name__ == '__main__':
     logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -23,7 +37,9 @@ if __name__ == '__main__':
         logging.error(f'Error connecting to MariaDB Platform: {e}')
         sys.exit(1)
 
-    t2DB = TextToDB(con, 'http://141.38.2.26/weather/text_forecasts/html/VHDL50_DWMG_LATEST_html')
-    t2DB.run()
+    with profiled('get_weather_text_to_db', cfg.PROFILE_DIR):
+        run(con)
+    METRICS.write_textfile(cfg.METRICS_DIR, 'get_weather_text_to_db')
 
+    con.close()
     logging.info('Script finished successfully')
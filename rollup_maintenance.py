@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+import sys
+import mariadb
+import logging
+
+from src.rollup import refresh_all, apply_retention
+from src.metrics import METRICS, profiled
+
+import config as cfg
+import public_passwords as pw
+
+
+def run(con: 'mariadb.connection') -> bool:
+    """
+    Refreshes all rollup tiers and then applies the retention policy, which relies on the refreshed tiers.
+    :param con: DB connection
+    :return: True if any tier got new buckets
+    """
+    refreshed = refresh_all(con)
+    logging.info(f'refreshed rollups: {refreshed}')
+    apply_retention(con, cfg.RAW_RETENTION_DAYS, cfg.TIER_RETENTION_DAYS, cfg.ARCHIVE_DIR)
+    return any(refreshed.values())
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        filename='/home/pi/logs/rollup_wetter.log',
+                        level=logging.INFO)
+    logging.info(' *  Script started - connecting to DB')
+    try:
+        con = mariadb.connect(
+            database='wetter',
+            **pw.mariadb_cred
+        )
+    except mariadb.Error as e:
+        logging.error(f'Error connecting to MariaDB Platform: {e}')
+        sys.exit(1)
+    logging.info('connected to MariaDB - wetter')
+
+    with profiled('rollup_maintenance', cfg.PROFILE_DIR):
+        run(con)
+    METRICS.write_textfile(cfg.METRICS_DIR, 'rollup_maintenance')
+
+    con.close()
+    logging.info('done')
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import sys
+import signal
+import logging
+import mariadb
+
+from src.scheduler import Scheduler, Job
+from src.measurement_buffer import MeasurementBuffer
+from src import schema
+from src.metrics import METRICS
+from src.lazy import lazy_import, load
+
+import config as cfg
+import public_passwords as pw
+
+import forecast_loader_dwd
+import get_weather_text_to_db
+import rollup_maintenance
+import temperature_pressure_db
+import verify_forecast
+import weather_graph
+
+
+def build_scheduler(pool: 'mariadb.ConnectionPool') -> Scheduler:
+    """
+    Registers all jobs of the weather station. The graphs are re-rendered right after new measurements or a new
+    forecast landed in the DB, in addition to their own interval.
+    :param pool: MariaDB connection pool
+    :return: scheduler with all jobs
+    """
+    buffer = MeasurementBuffer(cfg.MEASUREMENT_BUFFER_PATH)
+    sensors = temperature_pressure_db.Sensors()
+    intervals = cfg.JOB_INTERVALS_S
+    delays = cfg.JOB_START_DELAYS_S
+
+    scheduler = Scheduler(pool, workers=cfg.SCHEDULER_WORKERS, status_path=cfg.SCHEDULER_STATUS_PATH,
+                          metrics_dir=cfg.METRICS_DIR, profile_dir=cfg.PROFILE_DIR)
+    scheduler.add(Job('sample', lambda _: temperature_pressure_db.store_sample(buffer, *sensors.read()),
+                      intervals['sample'], needs_db=False, delay=delays.get('sample', 0)))
+    scheduler.add(Job('flush_measurements', lambda con: buffer.flush_all(con) > 0, intervals['flush_measurements'],
+                      delay=delays.get('flush_measurements', 0)))
+    scheduler.add(Job('forecast', forecast_loader_dwd.run, intervals['forecast'], delay=delays.get('forecast', 0)))
+    scheduler.add(Job('text_forecast', get_weather_text_to_db.run, intervals['text_forecast'],
+                      delay=delays.get('text_forecast', 0)))
+    # figures are reused in this long running process instead of forking render processes from a threaded one
+    scheduler.add(Job('graph', lambda con: weather_graph.run(con, workers=1), intervals['graph'],
+                      after=('forecast', 'flush_measurements'), delay=delays.get('graph', 0)))
+    scheduler.add(Job('rollup_maintenance', rollup_maintenance.run, intervals['rollup_maintenance'],
+                      delay=delays.get('rollup_maintenance', 0)))
+    scheduler.add(Job('verification', verify_forecast.run, intervals['verification'],
+                      delay=delays.get('verification', 0)))
+    return scheduler
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(threadName)s - %(levelname)s - %(message)s',
+                        filename='/home/pi/logs/scheduler_wetter.log',
+                        level=logging.INFO)
+    logging.info(' *  Scheduler started - creating connection pool')
+    try:
+        db_pool = mariadb.ConnectionPool(pool_name='wetter', pool_size=cfg.DB_POOL_SIZE, database='wetter',
+                                         **pw.mariadb_cred)
+    except mariadb.Error as e:
+        logging.error(f'Error connecting to MariaDB Platform: {e}')
+        sys.exit(1)
+
+    try:
+        con = db_pool.get_connection()
+        schema.migrate(con)
+        for problem in schema.verify(con):
+            logging.warning(f'schema: {problem}')
+        con.close()
+    except mariadb.Error as e:
+        logging.error(f'Could not check the DB schema: {e}')
+
+    if cfg.METRICS_HTTP is not None:
+        METRICS.serve(cfg.METRICS_HTTP, 'scheduler')
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    # imports shared by the jobs are loaded before the job threads start
+    load(*(lazy_import(name) for name in ('numpy', 'pandas', 'lxml.etree', 'lxml.html', 'matplotlib')))
+    build_scheduler(db_pool).run_forever()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import re
+import json
+import logging
+import threading
+from time import monotonic
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import mariadb
+
+from src.lazy import lazy_import, load
+from src.metrics import METRICS, timed, inc
+from src.rollup import load_tier, select_tier
+from src.dtypes import FORECAST, compact
+from src.dwd_forecast import DwdForecastLoader
+from src import schema
+
+pd = lazy_import('pandas')
+
+_STATION_ID = re.compile(r'\w{1,8}')
+
+
+class ResponseCache:
+    """
+    Thread safe LRU cache of rendered responses, entries expire after ttl_s. The keys start with the data source
+    and its generation, so a write of the loaders makes all entries of that source unreachable; drop frees them.
+    """
+    def __init__(self, max_entries: int = 128, ttl_s: float = 300.):
+        """
+        :param max_entries: number of responses kept, the least recently used one is evicted first
+        :param ttl_s: seconds a response is served at most
+        """
+        self._max_entries = max_entries
+        self._ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expiry, response)
+
+    def get(self, key: tuple):
+        """
+        :return: cached response or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: tuple, response) -> None:
+        with self._lock:
+            self._entries[key] = (monotonic() + self._ttl_s, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def drop(self, source: str) -> None:
+        """
+        Removes all entries of a data source.
+        """
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == source]:
+                del self._entries[key]
+
+
+def _param(query: dict, name: str, default: str = None) -> Optional[str]:
+    values = query.get(name)
+    return values[-1] if values else default
+
+
+def _timestamp(value: Optional[str], utc: bool) -> Optional[pd.Timestamp]:
+    """
+    Parses an ISO timestamp into the naive time of the table: UTC for forecasts, local time for measurements.
+    """
+    if value is None:
+        return None
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert('UTC') if utc else pd.Timestamp(ts.to_pydatetime().astimezone())
+        ts = ts.tz_localize(None)
+    return ts
+
+
+def _resolution(value: str) -> pd.Timedelta:
+    resolution = pd.Timedelta(value)
+    if resolution <= pd.Timedelta(0):
+        raise ValueError(f'resolution {value} must be positive')
+    return resolution
+
+
+class QueryApi:
+    """
+    Read-only HTTP API over schema wetter, so clients can pull the window they need as JSON or CSV:
+
+    GET /measurements?from=2024-05-01T00:00&to=2024-05-08&resolution=1h&stat=mean&format=json
+        aggregated measurements (local time) from the coarsest rollup tier which resolves the resolution, as last
+        refreshed by rollup_maintenance.py (the API only reads)
+    GET /forecast?station=P830,N2147&from=...&to=...&resolution=3h&format=csv
+        latest dwd forecast (UTC) of the given stations, default: the configured ones
+
+    Responses are cached per request and generation of their data source (wetter.data_generation, bumped by the
+    loaders), the generations are polled at most every poll_s seconds.
+    """
+    FORMATS = {'json': 'application/json', 'csv': 'text/csv; charset=utf-8'}
+    STATS = ('min', 'mean', 'max', 'median')
+
+    def __init__(self, pool: 'mariadb.ConnectionPool', cache: ResponseCache = None, station_ids: list = (),
+                 retention_days: dict = None, max_rows: int = 50000, default_days: float = 3, poll_s: float = 2.):
+        """
+        :param pool: MariaDB connection pool
+        :param cache: response cache, default: 128 entries for 5 minutes
+        :param station_ids: forecast stations returned if the request names none
+        :param retention_days: dict tier table -> days kept, see select_tier
+        :param max_rows: largest accepted number of rows (time range / resolution) per response
+        :param default_days: days returned if the request has no start
+        :param poll_s: seconds between two reads of the data generations
+        """
+        self._pool = pool
+        self._cache = cache if cache is not None else ResponseCache()
+        self._station_ids = list(station_ids)
+        self._retention_days = retention_days
+        self._max_rows = max_rows
+        self._default_days = default_days
+        self._poll_s = poll_s
+        self._lock = threading.Lock()
+        self._generations = {}
+        self._polled = None
+
+    def _generation(self, con: 'mariadb.connection', source: str) -> int:
+        with self._lock:
+            if self._polled is None or monotonic() - self._polled > self._poll_s:
+                current = schema.generations(con)
+                for name in set(current) | set(self._generations):
+                    if current.get(name) != self._generations.get(name):
+                        self._cache.drop(name)
+                self._generations = current
+                self._polled = monotonic()
+            return self._generations.get(source, 0)
+
+    def _check_rows(self, since: pd.Timestamp, until: Optional[pd.Timestamp], resolution: pd.Timedelta) -> None:
+        rows = ((until if until is not None else pd.Timestamp.now()) - since) / resolution
+        if rows > self._max_rows:
+            raise ValueError(f'{rows:.0f} rows requested, at most {self._max_rows}: shorten the range or use a '
+                             f'coarser resolution')
+
+    def _cached(self, key: tuple, build) -> bytes:
+        body = self._cache.get(key)
+        if body is not None:
+            inc('api_cache_hits')
+            return body
+        inc('api_cache_misses')
+        body = build()
+        self._cache.put(key, body)
+        return body
+
+    @staticmethod
+    def _render(df: pd.DataFrame, fmt: str, meta: dict, utc: bool) -> bytes:
+        """
+        :return: csv, or json {"meta": {...}, "columns": [...], "data": [[...], ...]}
+        """
+        df = df.round({col: 3 for col in df.select_dtypes('number').columns})
+        for col in df.columns:
+            if pd.api.types.is_datetime64_any_dtype(df[col]):
+                df[col] = df[col].dt.strftime('%Y-%m-%dT%H:%M:%SZ' if utc else '%Y-%m-%dT%H:%M:%S')
+        if fmt == 'csv':
+            return df.to_csv(index=False).encode()
+        split = df.to_json(orient='split', index=False, double_precision=3)
+        return ('{"meta":' + json.dumps(meta) + ',' + split[1:]).encode()
+
+    @timed('api_measurements')
+    def measurements(self, con: 'mariadb.connection', query: dict) -> bytes:
+        fmt = _param(query, 'format', 'json')
+        resolution_str = _param(query, 'resolution', '30min')
+        resolution = _resolution(resolution_str)
+        stat = _param(query, 'stat', 'mean')
+        if stat not in self.STATS:
+            raise ValueError(f'stat must be one of {", ".join(self.STATS)}')
+        until = _timestamp(_param(query, 'to'), utc=False)
+        since = _timestamp(_param(query, 'from'), utc=False)
+        if since is None:  # aligned to the resolution, so the default window is a stable cache key
+            since = ((until if until is not None else pd.Timestamp.now())
+                     - pd.Timedelta(days=self._default_days)).floor(resolution)
+        self._check_rows(since, until, resolution)
+        table, freq = select_tier(since.to_pydatetime(), resolution_str, self._retention_days)
+
+        key = ('rollup', self._generation(con, 'rollup'), table, since, until, resolution, stat, fmt)
+
+        def build() -> bytes:
+            df = load_tier(con, table, since.to_pydatetime(),
+                           stat={'temperature': stat, 'pressure': stat, 'hell': 'median' if stat == 'mean' else stat},
+                           until=None if until is None else until.to_pydatetime())
+            if pd.Timedelta(freq) < resolution and not df.empty:
+                # coarser than the tier: aggregates of the tier buckets (the mean is not weighted by n)
+                df = df.resample(resolution, on='zeit').agg(stat).dropna(how='all').reset_index()
+            return self._render(df, fmt, {'source': table, 'resolution': resolution_str, 'stat': stat},
+                                utc=False)
+        return self._cached(key, build)
+
+    @timed('api_forecast')
+    def forecast(self, con: 'mariadb.connection', query: dict) -> bytes:
+        fmt = _param(query, 'format', 'json')
+        resolution_str = _param(query, 'resolution', '1h')
+        resolution = _resolution(resolution_str)
+        station_ids = [s for value in query.get('station', []) for s in value.split(',') if s] or self._station_ids
+        invalid = [s for s in station_ids if not _STATION_ID.fullmatch(s)]
+        if invalid or not station_ids:
+            raise ValueError(f'invalid or missing station id(s): {", ".join(invalid)}')
+        until = _timestamp(_param(query, 'to'), utc=True)
+        since = _timestamp(_param(query, 'from'), utc=True)
+        if since is None:
+            since = pd.Timestamp.now(tz='UTC').floor('h').tz_localize(None)
+        self._check_rows(since, until if until is not None else since + pd.Timedelta(days=10),
+                         resolution / len(station_ids))
+
+        key = ('forecast', self._generation(con, 'forecast'), tuple(station_ids), since, until, resolution, fmt)
+
+        def build() -> bytes:
+            columns = ['station_id', 'ts', 'last_update'] + DwdForecastLoader.VALUE_COLUMNS
+            df = pd.read_sql(con=con, sql=f"""
+                SELECT {', '.join(columns)} FROM wetter.forecast_dwd
+                WHERE station_id IN ({', '.join('?' * len(station_ids))}) AND ts >= ?
+                {'AND ts < ?' if until is not None else ''}
+                ORDER BY station_id, ts""",
+                             params=(*station_ids, since.to_pydatetime(),
+                                     *(() if until is None else (until.to_pydatetime(),))))
+            df = compact(df, FORECAST)
+            df['station_id'] = df['station_id'].astype(str)
+            df['ts'] = pd.to_datetime(df['ts'])  # object dtype if there are no rows
+            if resolution > pd.Timedelta('1h') and not df.empty:
+                # ww: the most significant (highest) code of the interval
+                agg = {col: 'max' if col in ('ww', 'last_update') else 'mean'
+                       for col in columns if col not in ('station_id', 'ts')}
+                df = (df.groupby(['station_id', df['ts'].dt.floor(resolution)])
+                      .agg(agg)
+                      .reset_index())
+            return self._render(df, fmt, {'source': 'forecast_dwd', 'resolution': resolution_str}, utc=True)
+        return self._cached(key, build)
+
+    def handle(self, target: str) -> (int, str, bytes):
+        """
+        Answers one GET request.
+
+        :param target: request path with query string
+        :return: tuple (HTTP status, content type, body)
+        """
+        parts = urlsplit(target)
+        path = parts.path.rstrip('/')
+        if path == '/metrics':
+            return 200, 'text/plain; version=0.0.4; charset=utf-8', METRICS.render('weather_api').encode()
+        endpoint = {'/measurements': self.measurements, '/forecast': self.forecast}.get(path)
+        if endpoint is None:
+            return 404, 'text/plain; charset=utf-8', b'unknown path, use /measurements or /forecast\n'
+        query = parse_qs(parts.query)
+        fmt = _param(query, 'format', 'json')
+        if fmt not in self.FORMATS:
+            return 400, 'text/plain; charset=utf-8', f'format must be one of {", ".join(self.FORMATS)}\n'.encode()
+        try:
+            con = self._pool.get_connection()
+            try:
+                return 200, self.FORMATS[fmt], endpoint(con, query)
+            finally:
+                con.close()  # returns the connection to the pool
+        except ValueError as e:
+            return 400, 'text/plain; charset=utf-8', f'{e}\n'.encode()
+        except mariadb.Error as e:
+            logging.error(f'Error answering {target}: {e}')
+            inc('api_db_errors')
+            return 503, 'text/plain; charset=utf-8', b'database not available\n'
+        except Exception:
+            logging.exception(f'Error answering {target}')
+            inc('api_errors')
+            return 500, 'text/plain; charset=utf-8', b'internal error\n'
+
+    def make_server(self, address: tuple) -> ThreadingHTTPServer:
+        """
+        :param address: tuple (host, port)
+        :return: HTTP server answering with handle, not yet running
+        """
+        api = self
+        load(pd)  # before the request threads use it
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, content_type, body = api.handle(self.path)
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug(f'{self.address_string()} {format % args}')
+
+        return ThreadingHTTPServer(address, Handler)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import logging
+from datetime import datetime, timedelta
+from time import perf_counter
+from typing import Optional
+
+import mariadb
+
+from src.lazy import lazy_import
+from src.metrics import timed, inc
+from src.dtypes import FORECAST, compact
+from src import schema
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# values which are bias corrected and weighted by skill (verified by src/verification.py), the others are averaged
+CORRECTED = ('temperatur', 'druck')
+AVERAGED = ('sonnenscheinminuten', 'wind_max_1h', 'wind', 'niederschlag_1h', 'p_regen')
+# smallest error variance used for a weight, keeps a (nearly) perfect station from taking all the weight
+_MIN_VARIANCE = 1e-3
+
+
+def ww_mode(keys: pd.Series, ww: pd.Series) -> pd.Series:
+    """
+    Most frequent significant weather code per key, computed from (key, ww) group sizes instead of a python
+    value_counts per group. Ties are resolved deterministically to the higher (more significant) ww code.
+    :param keys: group keys, e.g. timestamps or resample buckets
+    :param ww: significant weather codes aligned with keys
+    :return: series of ww codes indexed by key (sorted), keys without any code are missing
+    """
+    counts = (pd.DataFrame({'key': keys.values, 'ww': ww.values})
+              .dropna()
+              .groupby(['key', 'ww'])
+              .size()
+              .reset_index(name='n')
+              .sort_values(['key', 'n', 'ww'], ascending=[True, False, False]))
+    return counts.drop_duplicates('key').set_index('key')['ww'].astype('int64')
+
+
+class Blender:
+    """
+    Class used to blend the forecasts of several stations into one locally corrected series (wetter.forecast_blend).
+
+    Temperature and pressure of each station are corrected by its mean error (forecast - measured) of the last
+    window_days (wetter.forecast_skill_daily) and weighted by the inverse variance of the remaining error. Stations
+    without enough verification are left out of a corrected value as soon as any station is corrected (their
+    uncorrected pressure is at sea level, the corrected one at station level), the plain mean is taken only while no
+    station is corrected. The other values are averaged and ww is the mode over the stations. The blend is only
+    recomputed from the first timestamp of the issues loaded since the last blend, it is meant to run right after the
+    forecast loader.
+    """
+    def __init__(self, con: 'mariadb.connection', station_ids: list, window_days: float = 14, min_hours: int = 48):
+        """
+        :param con: Maria DB connection
+        :param station_ids: dwd stations to be blended
+        :param window_days: days of verification used for bias and weights
+        :param min_hours: distinct verified hours a station needs within the window, otherwise it is not corrected
+         (and left out of the corrected values while any other station is corrected)
+        """
+        self._con = con
+        self._station_ids = list(station_ids)
+        self._window_days = window_days
+        self._min_hours = min_hours
+
+    def skill(self, today: datetime = None) -> (dict, dict):
+        """
+        :param today: last day of the window, default today
+        :return: tuple (dict variable -> dict station id -> bias, dict variable -> dict station id -> weight)
+        """
+        today = today if today is not None else datetime.now()
+        stations = ', '.join('?' * len(self._station_ids))
+        sums = pd.read_sql(con=self._con,
+                           sql=f"""SELECT station_id, variable, SUM(n) AS n, SUM(hours) AS hours,
+                                          SUM(sum_err) AS sum_err, SUM(sum_sq_err) AS sum_sq_err
+                                   FROM wetter.forecast_skill_daily
+                                   WHERE station_id IN ({stations}) AND day >= ?
+                                   GROUP BY station_id, variable""",
+                           params=(*self._station_ids, (today - timedelta(days=self._window_days)).date()))
+        sums = sums.loc[sums['hours'] >= self._min_hours]
+        n = sums['n'].astype(float)
+        sums = sums.assign(bias=sums['sum_err'] / n,
+                           variance=np.maximum(sums['sum_sq_err'] / n - (sums['sum_err'] / n) ** 2, _MIN_VARIANCE))
+        biases, weights = {}, {}
+        for variable in CORRECTED:
+            known = sums.loc[sums['variable'] == variable].set_index('station_id')
+            fallback = 0. if not known.empty else 1.  # uncorrected values are not mixed with corrected ones
+            biases[variable] = {s: float(known['bias'].get(s, 0.)) for s in self._station_ids}
+            weights[variable] = {s: float(1 / known['variance'][s]) if s in known.index else fallback
+                                 for s in self._station_ids}
+        return biases, weights
+
+    @staticmethod
+    def blend(df_raw: pd.DataFrame, biases: dict, weights: dict) -> pd.DataFrame:
+        """
+        :param df_raw: forecast rows of all stations with columns station_id, ts, last_update and the values
+        :param biases: dict variable -> dict station id -> bias, as returned by skill
+        :param weights: dict variable -> dict station id -> weight, as returned by skill
+        :return: frame indexed by ts with last_update (oldest issue of the stations), the blended values, ww and
+         the mean correction of each corrected value (<variable>_bias)
+        """
+        station = df_raw['station_id'].astype(str)
+        ts = df_raw['ts']
+        by_ts = df_raw.groupby('ts')
+        out = by_ts[list(AVERAGED)].mean().astype('float64')
+        out.insert(0, 'last_update', by_ts['last_update'].min())
+        for variable in CORRECTED:
+            values = df_raw[variable].to_numpy(dtype='float64')
+            bias = station.map(biases[variable]).to_numpy(dtype='float64')
+            weight = np.where(np.isnan(values), 0., station.map(weights[variable]).to_numpy(dtype='float64'))
+            sums = pd.DataFrame({'ts': ts.to_numpy(),
+                                 'value': np.nan_to_num(values - bias) * weight,
+                                 'bias': bias * weight,
+                                 'weight': weight}).groupby('ts').sum()
+            with np.errstate(invalid='ignore', divide='ignore'):
+                out[variable] = sums['value'] / sums['weight'].where(sums['weight'] > 0)
+                out[f'{variable}_bias'] = sums['bias'] / sums['weight'].where(sums['weight'] > 0)
+        out['ww'] = ww_mode(ts, df_raw['ww']).reindex(out.index).astype('Int64')
+        return out
+
+    def _pending(self) -> (Optional[datetime], Optional[datetime]):
+        """
+        :return: tuple (first timestamp to be recomputed, latest issue) or (None, None) if there is no new issue
+        """
+        cur = self._con.cursor()
+        cur.execute('SELECT MAX(issue_time) FROM wetter.forecast_blend')
+        last = cur.fetchone()[0]
+        cur.execute(f"""SELECT MIN(issue_time), MAX(issue_time) FROM wetter.forecast_dwd_issue
+                        WHERE station_id IN ({', '.join('?' * len(self._station_ids))}) AND issue_time > ?
+                        GROUP BY station_id""",
+                    (*self._station_ids, last if last is not None else datetime(1970, 1, 1)))
+        rows = cur.fetchall()
+        if not rows:
+            return None, None
+        # the first blend starts at the oldest current issue instead of the first issue ever loaded
+        start = min(row[0] for row in rows) if last is not None else min(row[1] for row in rows)
+        return start, max(row[1] for row in rows)
+
+    @timed('blend')
+    def run(self) -> int:
+        """
+        Recomputes the blend of all timestamps touched by issues loaded since the last run.
+
+        :return: number of blended timestamps written
+        """
+        start_run = perf_counter()
+        schema.migrate(self._con)
+        start, issue_time = self._pending()
+        if start is None:
+            logging.info('no new forecast issue, blend unchanged')
+            return 0
+        biases, weights = self.skill()
+        stations = ', '.join('?' * len(self._station_ids))
+        # the same issue per station as the graphs showed so far: the latest one, else the last change of the row
+        df_raw = pd.read_sql(con=self._con, sql=f"""
+            select
+                f.ts, f.station_id, coalesce(i.issue_time, f.last_update) as last_update,
+                {', '.join(f'f.{c}' for c in CORRECTED + AVERAGED)}, f.ww
+            from wetter.forecast_dwd f
+            left join (select station_id, max(issue_time) as issue_time
+                       from wetter.forecast_dwd_issue
+                       where station_id in ({stations})
+                       group by station_id) i on i.station_id = f.station_id
+            where f.station_id in ({stations}) and f.ts >= ?""",
+                             params=(*self._station_ids, *self._station_ids, start))
+        df_raw = compact(df_raw, FORECAST)
+        df_raw['ts'] = pd.to_datetime(df_raw['ts'])
+        blended = self.blend(df_raw, biases, weights) if not df_raw.empty else pd.DataFrame()
+
+        columns = ['last_update', *CORRECTED, *AVERAGED, 'ww', *(f'{c}_bias' for c in CORRECTED)]
+        rows = [(ts.to_pydatetime(), issue_time, *(None if pd.isna(v) else v for v in values))
+                for ts, *values in blended[columns].astype(object).itertuples(name=None)] if not blended.empty else []
+        try:
+            cur = self._con.cursor()
+            # timestamps no longer part of any forecast are dropped with the old blend
+            cur.execute('DELETE FROM wetter.forecast_blend WHERE ts >= ?', (start,))
+            if rows:
+                cur.executemany(f"""INSERT INTO wetter.forecast_blend (ts, issue_time, {', '.join(columns)})
+                                    VALUES ({', '.join('?' * (len(columns) + 2))})""", rows)
+            schema.bump_generation(cur, 'blend')
+            self._con.commit()
+        except mariadb.Error as e:
+            logging.error(f'Error when writing the forecast blend from {start}: {e}')
+            self._con.rollback()
+            return 0
+        inc('blend_rows_written', len(rows))
+        logging.info(f'blended {len(rows)} timestamps from {start} (issue {issue_time}) with bias {biases} and '
+                     f'weights {weights} in {perf_counter() - start_run:.3f}s')
+        return len(rows)
+
+
+def load_blend(con: 'mariadb.connection', since: datetime) -> pd.DataFrame:
+    """
+    Reads the blended forecast.
+
+    :param con: Maria DB connection
+    :param since: first timestamp (UTC)
+    :return: frame with columns ts, last_update and the blended values, empty if nothing is blended yet
+    """
+    df = pd.read_sql(con=con,
+                     sql=f"""SELECT ts, last_update, {', '.join(CORRECTED + AVERAGED)}, ww
+                             FROM wetter.forecast_blend WHERE ts >= ? ORDER BY ts""",
+                     params=(since,))
+    return compact(df, FORECAST)
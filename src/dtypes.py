@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Compact column types of the frames passed around by the loaders and the graphs. Forecast and measurement values
+carry at most 2 decimals (and are stored as FLOAT in MariaDB), so float32 loses nothing; the station id repeats on
+every row and becomes a category, the ww code fits a (nullable) uint8.
+"""
+
+# forecast frames, both the parsed ones (MOSMIX names) and the ones read from wetter.forecast_dwd
+FORECAST = {'station_id': 'category',
+            'ww': 'UInt8',
+            'temperatur': 'float32',
+            'temperatur_boden': 'float32',
+            'druck': 'float32',
+            'wind': 'float32',
+            'wind_max_1h': 'float32',
+            'niederschlag_1h': 'float32',
+            'p_regen': 'float32',
+            'p_regen_general': 'float32',
+            'sonnenscheinminuten': 'float32',
+            'sonnenscheindauer': 'float32',
+            'wolken': 'float32',
+            'wolken_eff': 'float32',
+            'sonnenstrahlung': 'float32',
+            'sonneneinstrahlung': 'float32'}
+
+# aggregated measurements (rollup tiers), hell is the median of the 0/1 light flag and may be 0.5
+MESSUNG = {'temperature': 'float32',
+           'pressure': 'float32',
+           'hell': 'float32'}
+
+
+def compact(df, dtypes: dict):
+    """
+    Casts the columns of df which are listed in dtypes, other columns and columns already in the target type are
+    left alone (no copy).
+
+    :param df: pandas DataFrame
+    :param dtypes: dict column -> dtype, e.g. FORECAST
+    :return: df with compact columns
+    """
+    casts = {col: dtype for col, dtype in dtypes.items() if col in df.columns and str(df[col].dtype) != dtype}
+    return df.astype(casts, copy=False) if casts else df
@@ -0,0 +1,482 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import logging
+import mariadb
+from typing import Optional
+from datetime import datetime
+
+from io import BytesIO
+import zipfile
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from src import schema
+from src.dtypes import FORECAST, compact
+from src.http_cache import CachedFetcher
+from src.lazy import lazy_import, load
+from src.metrics import timed, inc
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+etree = lazy_import('lxml.etree')
+
+
+class DwdForecastLoader:
+    """
+    Class used to load raw numerical forecast from dwd, extract needed values and save them into DB.
+    """
+    # frame column -> wetter.forecast_dwd column
+    _DB_COLUMNS = {'timestamp': 'ts',
+                   'station_id': 'station_id',
+                   'temperatur': 'temperatur',
+                   'druck': 'druck',
+                   'wind_max_1h': 'wind_max_1h',
+                   'ww': 'ww',
+                   'sonnenscheindauer': 'sonnenscheinminuten',
+                   'wolken_eff': 'wolken',
+                   'p_regen_general': 'p_regen',
+                   'niederschlag_1h': 'niederschlag_1h',
+                   'wind': 'wind',
+                   'temperatur_boden': 'temperatur_boden',
+                   'sonneneinstrahlung': 'sonnenstrahlung',
+                   'last_update': 'last_update'}
+
+    # forecast values, compared between two issues
+    VALUE_COLUMNS = [c for c in _DB_COLUMNS.values() if c not in ('ts', 'station_id', 'last_update')]
+
+    # requires the unique key (station_id, ts) on wetter.forecast_dwd, see README
+    _UPSERT_SQL = (f"INSERT INTO wetter.forecast_dwd ({', '.join(_DB_COLUMNS.values())}) "
+                   f"VALUES ({', '.join('?' * len(_DB_COLUMNS))}) "
+                   f"ON DUPLICATE KEY UPDATE "
+                   f"{', '.join(f'{c} = VALUES({c})' for c in _DB_COLUMNS.values() if c not in ('ts', 'station_id'))}")
+
+    _HISTORY_COLUMNS = ['station_id', 'issue_time', 'ts'] + VALUE_COLUMNS
+    _HISTORY_SQL = (f"INSERT IGNORE INTO wetter.forecast_dwd_history ({', '.join(_HISTORY_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * len(_HISTORY_COLUMNS))})")
+
+    # all stations in one file; MOSMIX_S is updated hourly and much smaller than MOSMIX_L/all_stations
+    BULK_URL = ('https://opendata.dwd.de/weather/local_forecasts/mos/MOSMIX_S/all_stations/kml/'
+                'MOSMIX_S_LATEST_240.kmz')
+
+    # MOSMIX element -> frame column
+    _ELEMENTS = {'TTT': 'temperatur',  # K
+                 'PPPP': 'druck',  # Pa
+                 'FX1': 'wind_max_1h',  # m/s
+                 'ww': 'ww',
+                 'SunD1': 'sonnenscheindauer',  # s/h
+                 'Neff': 'wolken_eff',  # in percent
+                 'R101': 'p_regen_general',
+                 'RR1c': 'niederschlag_1h',
+                 'FF': 'wind',
+                 'T5cm': 'temperatur_boden',  # K
+                 'Rad1h': 'sonneneinstrahlung'}
+
+    def __init__(self, con: 'MariaDB.connection', fetcher: CachedFetcher = None):
+        """
+        Initialize with given connection.
+
+        :param con: Maria DB connection
+        :param fetcher: http fetcher, pass one with a cache directory to skip unchanged forecasts
+        """
+        self._con = con
+        self._fetcher = fetcher if fetcher is not None else CachedFetcher()
+        self._station_id = None
+        self._df = None
+        pass
+
+    @property
+    def con(self):
+        return self._con
+
+    @property
+    def station_id(self):
+        return self._station_id
+
+    @property
+    def df(self):
+        return self._df
+
+    @staticmethod
+    def _element_name(forecast: etree.Element) -> str:
+        for key, value in forecast.attrib.items():
+            if etree.QName(key).localname == 'elementName':
+                return value
+        return ''
+
+    @staticmethod
+    def _value_array(text: str) -> np.ndarray:
+        """
+        Converts a whitespace separated MOSMIX value string into a float array, missing values ('-') become NaN.
+        """
+        return np.round(pd.to_numeric(np.array((text or '').split()), errors='coerce'), 1)
+
+    @staticmethod
+    def _parse_kml(source, station_ids: set = None, max_stations: int = None) -> (pd.Timestamp, list, dict):
+        """
+        Reads issue time, time steps and the requested forecast elements of each station (Placemark) in a single
+        streaming pass. Handled elements are cleared right away, so memory stays flat independent of the file size,
+        e.g. for the all-stations files with thousands of Placemarks. Parsing stops as soon as all requested
+        stations were found.
+
+        :param source: file name or file-like object of the KML document
+        :param station_ids: stations to be extracted, None for all
+        :param max_stations: stop after this number of stations, None for no limit
+        :return: triple (issue time, list of time step strings, dict station id -> dict element name -> value array)
+        """
+        issue_time = None
+        time_steps = []
+        stations = {}
+        for _, el in etree.iterparse(source, events=('end',), tag=('{*}IssueTime', '{*}TimeStep', '{*}Placemark')):
+            name = etree.QName(el).localname
+            if name == 'Placemark':
+                station_id = (el.findtext('{*}name') or '').strip()
+                if station_ids is None or station_id in station_ids:
+                    values = stations.setdefault(station_id, {})
+                    for forecast in el.iterfind('{*}ExtendedData/{*}Forecast'):
+                        element = DwdForecastLoader._element_name(forecast)
+                        if element in DwdForecastLoader._ELEMENTS and element not in values:
+                            values[element] = DwdForecastLoader._value_array(forecast.findtext('{*}value'))
+                    if len(stations) == (len(station_ids) if station_ids is not None else max_stations):
+                        break
+            elif name == 'TimeStep':
+                time_steps.append(el.text)
+            elif issue_time is None:
+                issue_time = pd.to_datetime(el.text)
+            el.clear()
+            while el.getprevious() is not None:
+                del el.getparent()[0]
+        return issue_time, time_steps, stations
+
+    @staticmethod
+    def _fc_df(time_steps: pd.DatetimeIndex, values: dict) -> pd.DataFrame:
+        """
+        :param time_steps: index of the forecast
+        :param values: dict MOSMIX element -> value array
+        :return: forecast frame with converted units, sorted by timestamp
+        """
+        fc_df = pd.DataFrame({DwdForecastLoader._ELEMENTS[element]: values.get(element, np.nan)
+                              for element in DwdForecastLoader._ELEMENTS},
+                             index=time_steps)
+        fc_df['temperatur'] -= 273.1
+        fc_df['temperatur_boden'] -= 273.1
+        fc_df['druck'] /= 100.0
+        fc_df['sonnenscheindauer'] = (fc_df['sonnenscheindauer'] / 60).round()  # in minutes/h
+        fc_df['ww'] = fc_df['ww'].round()
+
+        return compact(fc_df.sort_index(), FORECAST)
+
+    @staticmethod
+    def _return_fc_df(source) -> (pd.DataFrame, pd.Timestamp):
+        # see https://github.com/dirkclemens/dwd-opendata-kml/blob/master/dwd-opendata-kml.py
+        updated_at, time_steps, stations = DwdForecastLoader._parse_kml(source, max_stations=1)
+        values = next(iter(stations.values()), {})
+        return DwdForecastLoader._fc_df(pd.DatetimeIndex(pd.to_datetime(time_steps), name='timestamp'), values), \
+            updated_at
+
+    @staticmethod
+    def _return_fc_dfs(source, station_ids: list) -> (dict, pd.Timestamp):
+        """
+        Extracts several stations from a multi-station KML document (e.g. MOSMIX_S all_stations).
+
+        :param source: file name or file-like object of the KML document
+        :param station_ids: stations to be extracted
+        :return: tuple (dict station id -> forecast frame incl. columns last_update and station_id, issue time)
+        """
+        updated_at, time_steps, stations = DwdForecastLoader._parse_kml(source, set(station_ids))
+        index = pd.DatetimeIndex(pd.to_datetime(time_steps), name='timestamp')
+        dfs = {}
+        for station_id, values in stations.items():
+            df_ = DwdForecastLoader._fc_df(index, values)
+            df_['last_update'] = updated_at
+            df_['station_id'] = pd.Categorical.from_codes(np.zeros(len(df_), dtype='int8'), [station_id])
+            dfs[station_id] = df_
+        return dfs, updated_at
+
+    @staticmethod
+    def _db_frame(df: pd.DataFrame) -> pd.DataFrame:
+        """
+        :param df: forecast frame(s) indexed by timestamp as returned by fetch
+        :return: frame with the columns of wetter.forecast_dwd, naive (UTC) timestamps
+        """
+        df_ = df.reset_index()[list(DwdForecastLoader._DB_COLUMNS)].rename(columns=DwdForecastLoader._DB_COLUMNS)
+        for col in ('ts', 'last_update'):
+            if df_[col].dt.tz is not None:
+                df_[col] = df_[col].dt.tz_convert(None)
+            df_[col] = df_[col].astype('datetime64[ns]')
+        return df_
+
+    @staticmethod
+    def _to_rows(df: pd.DataFrame, columns: list) -> list:
+        """
+        Converts frame columns into parameter tuples.
+
+        :param df: frame
+        :param columns: columns in the order of the statement's placeholders
+        :return: list of tuples with plain python values, missing values are None
+        """
+        df_ = df[columns].copy()
+        for col in df_.columns:
+            if pd.api.types.is_datetime64_any_dtype(df_[col]):
+                df_[col] = df_[col].dt.strftime('%Y-%m-%d %H:%M:%S')
+        df_ = df_.astype(object).where(df_.notna(), None)
+        return list(df_.itertuples(index=False, name=None))
+
+    def _current(self, station_ids: list, since: pd.Timestamp) -> pd.DataFrame:
+        """
+        :return: rows of wetter.forecast_dwd of the given stations from since on
+        """
+        current = pd.read_sql(con=self._con,
+                              sql=f"""SELECT station_id, ts, {', '.join(self.VALUE_COLUMNS)} FROM wetter.forecast_dwd
+                                      WHERE station_id IN ({', '.join('?' * len(station_ids))}) AND ts >= ?""",
+                              params=(*station_ids, since.to_pydatetime()))
+        current['ts'] = pd.to_datetime(current['ts']).astype('datetime64[ns]')
+        return current
+
+    def _stations_with_history(self, station_ids: list) -> set:
+        cur = self._con.cursor()
+        cur.execute(f"""SELECT DISTINCT station_id FROM wetter.forecast_dwd_issue
+                        WHERE station_id IN ({', '.join('?' * len(station_ids))})""", tuple(station_ids))
+        return {station_id for station_id, in cur.fetchall()}
+
+    def _delta(self, new: pd.DataFrame) -> (pd.DataFrame, pd.DataFrame):
+        """
+        Compares a new issue with the latest stored version of each (station_id, ts).
+
+        :param new: db frame of the new issue(s)
+        :return: tuple (rows of new which are new or changed, (station_id, ts) of stored rows missing in new)
+        """
+        first_ts = new.groupby('station_id')['ts'].min()
+        current = self._current(list(first_ts.index), first_ts.min())
+        current = current.loc[current['ts'] >= current['station_id'].map(first_ts)]
+        merged = new.merge(current, on=['station_id', 'ts'], how='outer', suffixes=('', '_old'), indicator=True)
+
+        changed = merged['_merge'] == 'left_only'
+        for col in self.VALUE_COLUMNS:
+            # values are stored as FLOAT, so compare with a tolerance below the rounding of the parser
+            changed |= ~np.isclose(merged[col].astype(float), merged[f'{col}_old'].astype(float),
+                                   rtol=1e-6, atol=1e-3, equal_nan=True)
+        seeded = self._stations_with_history(list(first_ts.index))
+        changed |= ~merged['station_id'].isin(seeded)  # first issue of a station: the history starts complete
+        in_new = merged['_merge'] != 'right_only'
+        return merged.loc[changed & in_new, new.columns], merged.loc[~in_new, ['station_id', 'ts']]
+
+    @staticmethod
+    def _is_url(source: str) -> bool:
+        return source.startswith(('http://', 'https://'))
+
+    @staticmethod
+    def _url(station_id: str) -> str:
+        return (f'https://opendata.dwd.de/weather/local_forecasts/mos/MOSMIX_L/single_stations/{station_id}/kml/'
+                f'MOSMIX_L_LATEST_{station_id}.kmz'
+                )
+
+    def fetch(self, station_id: str = 'P830') -> Optional[pd.DataFrame]:
+        """
+        Downloads and parses the latest MOSMIX_L forecast of a station. Does not touch the DB, so it can run in
+        worker threads.
+
+        :param station_id: dwd station id
+        :return: forecast frame indexed by timestamp incl. columns last_update and station_id,
+         None if the forecast did not change since it was last written
+        """
+        with timed('dwd_download'):
+            body = self._fetcher.fetch(self._url(station_id))
+        if body is None:
+            inc('dwd_not_modified')
+            return None
+        with timed('dwd_parse'), zipfile.ZipFile(BytesIO(body), 'r') as kmz:
+            with kmz.open(kmz.namelist()[0], 'r') as kml:
+                df_, time = DwdForecastLoader._return_fc_df(kml)
+
+        df_['last_update'] = time
+        df_['station_id'] = pd.Categorical.from_codes(np.zeros(len(df_), dtype='int8'), [station_id])
+        return df_
+
+    def fetch_bulk(self, station_ids: list, source: str = BULK_URL) -> Optional[dict]:
+        """
+        Reads the forecasts of the given stations from one multi-station MOSMIX file in a single streaming pass,
+        only the requested Placemarks are converted.
+
+        :param station_ids: dwd station ids
+        :param source: url or local path of a KMZ or KML file, e.g. the all-stations MOSMIX_S file
+        :return: dict station id -> forecast frame (stations missing in the file are left out),
+         None if the file did not change since it was last written
+        """
+        if self._is_url(source):
+            with timed('dwd_download'):
+                body = self._fetcher.fetch(source)
+            if body is None:
+                inc('dwd_not_modified')
+                return None
+            source = BytesIO(body)
+        with timed('dwd_parse'):
+            if zipfile.is_zipfile(source):
+                with zipfile.ZipFile(source, 'r') as kmz, kmz.open(kmz.namelist()[0], 'r') as kml:
+                    dfs, _ = DwdForecastLoader._return_fc_dfs(kml, station_ids)
+            else:
+                if not isinstance(source, str):
+                    source.seek(0)
+                dfs, _ = DwdForecastLoader._return_fc_dfs(source, station_ids)
+        missing = [station_id for station_id in station_ids if station_id not in dfs]
+        if missing:
+            logging.warning(f'stations not found in the forecast file: {", ".join(missing)}')
+        return dfs
+
+    @timed('dwd_read_forecast')
+    def _read_forecast(self, station_id: str = 'P830') -> None:
+        self._station_id = station_id
+        self._df = self.fetch(station_id)
+        return
+
+    @timed('dwd_write_db')
+    def _write_to_db(self) -> bool:
+        """
+        Upserts the current forecast frame into wetter.forecast_dwd in a single transaction.
+
+        :return: True if the transaction was committed
+        """
+        return self._write_frames({self._station_id: self._df}, self._url(self._station_id))
+
+    def _write_frames(self, dfs: dict, url: Optional[str]) -> bool:
+        """
+        Stores new issues of several stations in a single transaction, writing only what changed.
+
+        Each issue is compared with the latest stored version of every (station_id, ts). Only new or changed rows
+        are upserted into wetter.forecast_dwd (the latest forecast, last_update is the issue which last changed
+        the row) and appended to wetter.forecast_dwd_history (keyed by station_id, ts, issue_time). Rows which
+        are no longer part of a forecast are removed from forecast_dwd, every issue is logged in
+        wetter.forecast_dwd_issue.
+
+        :param dfs: dict station id -> forecast frame as returned by fetch
+        :param url: source which is marked as processed once the transaction is committed, None for local files
+        :return: True if the transaction was committed
+        """
+        start = perf_counter()
+        schema.migrate(self._con)
+        new = self._db_frame(pd.concat(dfs.values()))
+        changed, stale = self._delta(new)
+        history = changed.rename(columns={'last_update': 'issue_time'})
+        issues = (new.groupby('station_id')
+                  .agg(issue_time=('last_update', 'first'), n_rows=('ts', 'size'))
+                  .join(changed.groupby('station_id').size().rename('n_changed'))
+                  .fillna({'n_changed': 0})
+                  .reset_index())
+
+        logging.info('now writing into wetter.forecast_dwd')
+        cur = self._con.cursor()
+        try:
+            if not changed.empty:
+                cur.executemany(self._UPSERT_SQL, self._to_rows(changed, list(self._DB_COLUMNS.values())))
+                cur.executemany(self._HISTORY_SQL, self._to_rows(history, self._HISTORY_COLUMNS))
+            if not stale.empty:
+                cur.executemany('DELETE FROM wetter.forecast_dwd WHERE station_id = ? AND ts = ?',
+                                self._to_rows(stale, ['station_id', 'ts']))
+            if not (changed.empty and stale.empty):
+                schema.bump_generation(cur, 'forecast')
+            cur.executemany("""INSERT INTO wetter.forecast_dwd_issue (station_id, issue_time, n_rows, n_changed)
+                               VALUES (?, ?, ?, ?)
+                               ON DUPLICATE KEY UPDATE
+                                   n_rows = VALUES(n_rows), n_changed = n_changed + VALUES(n_changed)""",
+                            self._to_rows(issues.astype({'n_rows': int, 'n_changed': int}),
+                                          ['station_id', 'issue_time', 'n_rows', 'n_changed']))
+            self._con.commit()
+        except mariadb.Error as e:
+            logging.error(f'Error when upserting forecast of station(s) {", ".join(dfs)}: {e}')
+            self._con.rollback()
+            inc('dwd_write_errors')
+            return False
+        if url is not None:
+            self._fetcher.mark_processed(url)
+        inc('dwd_rows_written', len(changed))
+        inc('dwd_rows_unchanged', len(new) - len(changed))
+        logging.info(f'Done. {len(changed)} of {len(new)} rows of {len(dfs)} station(s) changed, {len(stale)} removed, '
+                     f'written in {perf_counter() - start:.3f}s.')
+        return True
+
+    @staticmethod
+    def load_issue(con: 'mariadb.connection', station_id: str, issue_time: datetime) -> pd.DataFrame:
+        """
+        Reconstructs a forecast as it was issued from wetter.forecast_dwd_history, e.g. to verify it against the
+        measurements.
+
+        :param con: Maria DB connection
+        :param station_id: dwd station id
+        :param issue_time: issue time (UTC, as stored in last_update)
+        :return: frame with columns ts, issue_time (of the version in effect) and the forecast values
+        """
+        return pd.read_sql(con=con,
+                           sql=f"""SELECT h.ts, h.issue_time, {', '.join(f'h.{c}' for c in
+                                                                           DwdForecastLoader.VALUE_COLUMNS)}
+                                   FROM wetter.forecast_dwd_history h
+                                   JOIN (SELECT ts, MAX(issue_time) AS issue_time
+                                         FROM wetter.forecast_dwd_history
+                                         WHERE station_id = ? AND issue_time <= ? AND ts > ?
+                                         GROUP BY ts) v ON v.ts = h.ts AND v.issue_time = h.issue_time
+                                   WHERE h.station_id = ?
+                                   ORDER BY h.ts""",
+                           params=(station_id, issue_time, issue_time, station_id))
+
+    def execute(self, station_id='P830'):
+        logging.info(f'Reading dwd data at station {station_id}.')
+        self._read_forecast(station_id)
+        if self._df is None:
+            logging.info(f'Forecast at station {station_id} not modified, skipped.')
+            return
+        logging.info('Writing data to DB.')
+        self._write_to_db()
+        logging.info(f'Done with forecast at station {station_id}.')
+
+    def execute_many(self, station_ids: list, workers: int = 4) -> int:
+        """
+        Downloads and parses the forecasts of several stations concurrently in a thread pool, while the DB writes
+        stay serialized on this loader's connection in the calling thread.
+
+        :param station_ids: dwd station ids
+        :param workers: max. number of concurrent downloads
+        :return: number of stations with a new forecast written
+        """
+        written = 0
+        load(np, pd, etree)  # imported once here instead of by the first fetch threads
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = {pool.submit(self._timed_fetch, station_id): station_id for station_id in station_ids}
+            for future in as_completed(futures):
+                station_id = futures[future]
+                try:
+                    df_, fetch_time = future.result()
+                except Exception as e:
+                    logging.error(f'Could not load forecast of station {station_id}: {e}')
+                    continue
+                if df_ is None:
+                    logging.info(f'Station {station_id}: not modified, checked in {fetch_time:.3f}s.')
+                    continue
+                start = perf_counter()
+                self._station_id = station_id
+                self._df = df_
+                written += self._write_to_db()
+                logging.info(f'Station {station_id}: fetched and parsed in {fetch_time:.3f}s, '
+                             f'written in {perf_counter() - start:.3f}s.')
+        return written
+
+    def execute_bulk(self, station_ids: list, source: str = BULK_URL) -> int:
+        """
+        Loads the forecasts of many stations from one multi-station file and writes them in one transaction.
+
+        :param station_ids: dwd station ids
+        :param source: url or local path of a KMZ or KML file
+        :return: number of stations with a new forecast written
+        """
+        logging.info(f'Reading forecasts of {len(station_ids)} stations from {source}.')
+        dfs = self.fetch_bulk(station_ids, source)
+        if dfs is None:
+            logging.info(f'{source} not modified, skipped.')
+            return 0
+        if not dfs:
+            return 0
+        return len(dfs) if self._write_frames(dfs, source if self._is_url(source) else None) else 0
+
+    def _timed_fetch(self, station_id: str) -> (Optional[pd.DataFrame], float):
+        with timed('dwd_read_forecast') as timer:
+            df_ = self.fetch(station_id)
+        return df_, timer.seconds
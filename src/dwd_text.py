@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import re
+import hashlib
+import logging
+from datetime import datetime
+from typing import Optional
+
+import mariadb
+
+from src.http_cache import CachedFetcher
+from src.lazy import lazy_import
+from src.metrics import timed, inc
+from src import schema
+
+html = lazy_import('lxml.html')
+
+# leaf elements holding the paragraphs of the page and elements marking a section heading
+_BLOCKS = ('p', 'pre', 'div', 'li', 'td', 'th', 'dd', 'dt', 'blockquote', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+_HEADINGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'th', 'dt'}
+_ISSUE_TIME = re.compile(r'(\d{1,2})\.(\d{1,2})\.(\d{4}),?\s*(?:um\s*)?(\d{1,2})[:.](\d{2})\s*Uhr')
+
+
+def _hash(*parts: str) -> str:
+    return hashlib.sha256('\x1f'.join(parts).encode()).hexdigest()
+
+
+class TextToDB:
+    """
+    Class used to read text weather forecast and save it to database.
+
+    The page is split into sections (heading and paragraphs). Sections are stored once, keyed by their content hash
+    in wetter.forecast_text_section, each new page in wetter.forecast_text_issue (keyed by the hash of the whole
+    text) with the ordered hashes of its sections in wetter.forecast_text_issue_section. A page which is already
+    known is detected by a single primary key lookup and a changed page only adds the sections which changed.
+    """
+    def __init__(self,
+                 connection: 'mariadb.connection',
+                 url: str,
+                 fetcher: CachedFetcher = None,
+                 keep_full_text: bool = True):
+        """
+        Initialize with given connection and url.
+
+        :param connection: Maria DB connection
+        :param url: website's url
+        :param fetcher: http fetcher, pass one with a cache directory to skip unchanged pages
+        :param keep_full_text: if True, every new page is also stored as a whole in wetter.forecast_text
+        """
+        self._con = connection
+        self._url = url
+        self._fetcher = fetcher if fetcher is not None else CachedFetcher()
+        self._keep_full_text = keep_full_text
+        self._text = None
+        self._issue_time = None
+        self._sections = []
+
+    @staticmethod
+    def _parse_page(body: bytes, encoding: Optional[str] = None) -> (Optional[datetime], list):
+        """
+        Splits the page into sections. A section starts at a heading (h1-h6, a paragraph which is bold as a whole
+        or a short line ending with a colon), paragraphs before the first heading form a section without heading.
+
+        :param body: html page
+        :param encoding: charset from the http header, None to let lxml detect it
+        :return: tuple (issue time (local time) if the page states one, list of (heading, text) tuples)
+        """
+        root = html.document_fromstring(body.decode(encoding, errors='replace') if encoding else body)
+        for element in root.iter('script', 'style', 'head'):
+            element.drop_tree()
+
+        paragraphs = []
+        for element in root.iter(*_BLOCKS):
+            if any(child.tag in _BLOCKS for child in element.iterdescendants()):
+                continue  # only leaf blocks, their parents would repeat the text
+            if element.tag == 'pre':  # preformatted: paragraphs are separated by blank lines, a heading line
+                chunks = []           # ending with a colon may directly precede its paragraph
+                for chunk in re.split(r'\n\s*\n', element.text_content()):
+                    first, _, rest = chunk.strip().partition('\n')
+                    chunks += [first, rest] if rest and len(first.strip()) <= 80 and first.strip().endswith(':') \
+                        else [chunk]
+            else:
+                chunks = [element.text_content()]
+            bold = len(element) == 1 and element[0].tag in ('b', 'strong') \
+                and not (element.text or '').strip() and not (element[0].tail or '').strip()
+            for chunk in chunks:
+                text = ' '.join(chunk.split())
+                if text:
+                    heading = len(text) <= 255 and (element.tag in _HEADINGS or bold
+                                                    or (len(text) <= 80 and text.endswith(':')))
+                    paragraphs.append((heading, text))
+
+        sections = []
+        for heading, text in paragraphs:
+            if heading or not sections:
+                sections.append([text.rstrip(':') if heading else '', [] if heading else [text]])
+            else:
+                sections[-1][1].append(text)
+
+        match = _ISSUE_TIME.search(' '.join(text for _, text in paragraphs))
+        issue_time = None
+        if match is not None:
+            day, month, year, hour, minute = (int(g) for g in match.groups())
+            try:
+                issue_time = datetime(year, month, day, hour, minute)
+            except ValueError:
+                pass
+        return issue_time, [(heading, '\n'.join(texts)) for heading, texts in sections]
+
+    @timed('text_read')
+    def _read_text(self) -> None:
+        """
+        Reads url and parses the page into sections
+
+        :return: None (changes self._text, which stays None if the page did not change)
+        """
+        self._text = None
+        self._sections = []
+        body = self._fetcher.fetch(self._url)
+        if body is None:
+            return
+        self._issue_time, self._sections = self._parse_page(body, self._fetcher.encoding(self._url))
+        self._text = '\n\n'.join(f'{heading}\n{text}' if heading else text for heading, text in self._sections)
+        return
+
+    @timed('text_write_db')
+    def _write_text_to_db(self) -> Optional[bool]:
+        """
+        Writes the sections of a new DWD text forecast into database
+        :return: True if a new text was inserted, False if it was empty or known already, None on DB errors
+        """
+        if not self._text:
+            logging.warning('empty text, aborted.')
+            return False
+        page_hash = _hash(self._text)
+        section_hashes = [_hash(heading, text) for heading, text in self._sections]
+        loaded_at = datetime.now().replace(microsecond=0)
+        try:
+            schema.migrate(self._con)
+            cur = self._con.cursor()
+            cur.execute('SELECT 1 FROM wetter.forecast_text_issue WHERE page_hash = ?', (page_hash,))
+            if cur.fetchone() is not None:
+                logging.info('text not new, nothing to write')
+                return False
+            cur.execute(f"""SELECT hash FROM wetter.forecast_text_section
+                            WHERE hash IN ({', '.join('?' * len(section_hashes))})""", tuple(section_hashes))
+            known = {row[0] for row in cur.fetchall()}
+            new_sections = {h: section for h, section in zip(section_hashes, self._sections) if h not in known}
+
+            logging.info(f'now writing {len(new_sections)} of {len(section_hashes)} sections into wetter')
+            if new_sections:
+                cur.executemany("""INSERT IGNORE INTO wetter.forecast_text_section (hash, heading, body)
+                                   VALUES (?, ?, ?)""",
+                                [(h, heading, text) for h, (heading, text) in new_sections.items()])
+            cur.execute('INSERT INTO wetter.forecast_text_issue (page_hash, loaded_at, issue_time) VALUES (?, ?, ?)',
+                        (page_hash, loaded_at, self._issue_time))
+            cur.executemany("""INSERT INTO wetter.forecast_text_issue_section (page_hash, position, section_hash)
+                               VALUES (?, ?, ?)""",
+                            [(page_hash, position, h) for position, h in enumerate(section_hashes)])
+            if self._keep_full_text:
+                cur.execute('INSERT INTO wetter.forecast_text (ts, forecast, fc_text) VALUES (?, 1, ?)',
+                            (loaded_at, self._text))
+            schema.bump_generation(cur, 'text')
+            self._con.commit()
+        except mariadb.Error as e:
+            logging.error(f'Error when inserting text: {e}')
+            self._con.rollback()
+            return None
+        inc('text_sections_written', len(new_sections))
+        inc('text_sections_unchanged', len(section_hashes) - len(new_sections))
+        logging.info(f'Done. Page {page_hash[:12]} issued {self._issue_time} stored.')
+        return True
+
+    @staticmethod
+    def load_text(con: 'mariadb.connection', page_hash: str = None) -> list:
+        """
+        Reassembles a stored page from its sections.
+
+        :param con: Maria DB connection
+        :param page_hash: page to load, None for the latest one
+        :return: list of (heading, text) tuples in page order, empty if there is no such page
+        """
+        cur = con.cursor()
+        if page_hash is None:
+            cur.execute('SELECT page_hash FROM wetter.forecast_text_issue ORDER BY loaded_at DESC LIMIT 1')
+            row = cur.fetchone()
+            if row is None:
+                return []
+            page_hash = row[0]
+        cur.execute("""SELECT s.heading, s.body FROM wetter.forecast_text_issue_section i
+                       JOIN wetter.forecast_text_section s ON s.hash = i.section_hash
+                       WHERE i.page_hash = ? ORDER BY i.position""", (page_hash,))
+        return [tuple(row) for row in cur.fetchall()]
+
+    def run(self) -> bool:
+        """
+        Gets text and saves it into DB.
+
+        :return: True if a new text was written
+        """
+        logging.info('Loading Text')
+        self._read_text()
+        written = False
+        if self._text is None:
+            logging.info('Page not modified, nothing to write')
+        else:
+            logging.info('Writing Text to DB')
+            written = self._write_text_to_db()
+            if written is not None:  # otherwise the page is loaded again next time
+                self._fetcher.mark_processed(self._url)
+        return bool(written)
+
+    @property
+    def con(self):
+        return self._con
+
+    @property
+    def url(self):
+        return self._url
+
+    @property
+    def text(self):
+        return self._text
+
+    @property
+    def sections(self):
+        return self._sections
+
+    @property
+    def issue_time(self):
+        return self._issue_time
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import logging
+from hashlib import sha1, sha256
+from typing import Optional
+
+import requests
+
+
+class CachedFetcher:
+    """
+    Class used to download urls with conditional requests. The ETag / Last-Modified validators and the content hash
+    of the last body of each url are kept in a cache directory, so unchanged sources can be skipped. The body itself
+    is not kept: the callers only process new bodies, an unchanged one is answered with None.
+    """
+    def __init__(self, cache_dir: Optional[str] = None, timeout: float = 60):
+        """
+        Initialize with given cache directory.
+
+        :param cache_dir: directory for the validators; None disables caching (plain GET on every fetch)
+        :param timeout: request timeout in seconds
+        """
+        self._cache_dir = cache_dir
+        self._timeout = timeout
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @property
+    def cache_dir(self):
+        return self._cache_dir
+
+    def _path(self, url: str, suffix: str) -> str:
+        return os.path.join(self._cache_dir, sha1(url.encode()).hexdigest() + suffix)
+
+    def _load_meta(self, url: str) -> dict:
+        if self._cache_dir is None:
+            return {}
+        try:
+            with open(self._path(url, '.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_meta(self, url: str, meta: dict) -> None:
+        tmp = self._path(url, '.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._path(url, '.json'))
+
+    def fetch(self, url: str, force: bool = False) -> Optional[bytes]:
+        """
+        Downloads url unless the cached copy is still current.
+
+        The validators of a body are only sent once the caller confirmed it with mark_processed, so a failed
+        processing run gets the same body again on the next fetch.
+
+        :param url: url to be loaded
+        :param force: ignore the cache and always return the body
+        :return: body, or None if the server answered 304 or the content hash did not change
+        """
+        meta = self._load_meta(url)
+        conditional = meta.get('processed', False) and not force
+        headers = {}
+        if conditional and meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if conditional and meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+        response = requests.get(url, headers=headers, timeout=self._timeout)
+        if response.status_code == 304:
+            logging.info(f'{url} not modified (304)')
+            return None
+        response.raise_for_status()
+
+        body = response.content
+        digest = sha256(body).hexdigest()
+        if self._cache_dir is None:
+            return body
+
+        unchanged = conditional and digest == meta.get('sha256')
+        meta.update(etag=response.headers.get('ETag'),
+                    last_modified=response.headers.get('Last-Modified'),
+                    encoding=requests.utils.get_encoding_from_headers(response.headers),
+                    sha256=digest,
+                    processed=unchanged)
+        if unchanged:
+            logging.info(f'{url} unchanged (same content hash)')
+            self._save_meta(url, meta)
+            return None
+
+        self._save_meta(url, meta)
+        return body
+
+    def mark_processed(self, url: str) -> None:
+        """
+        Confirms that the last fetched body of url was processed, later fetches become conditional.
+
+        :param url: url as passed to fetch
+        :return: None
+        """
+        meta = self._load_meta(url)
+        if meta:
+            meta['processed'] = True
+            self._save_meta(url, meta)
+
+    def encoding(self, url: str) -> Optional[str]:
+        """
+        :return: charset given by the server for the last fetched body of url, if any
+        """
+        return self._load_meta(url).get('encoding')
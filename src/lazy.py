@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+import sys
+import types
+import importlib
+import importlib.util
+import threading
+
+
+class _LazyModule(types.ModuleType):
+    """
+    Placeholder of a module which imports it on the first attribute access. The import runs under a lock and with
+    the regular (thread safe) import machinery, so threads touching the module at the same time all wait for the
+    complete module (importlib.util.LazyLoader hands out half-initialized modules to concurrent threads before
+    Python 3.12). Afterwards the attributes of the module are copied, later accesses are plain lookups.
+    """
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.__dict__['_lazy_lock'] = threading.Lock()
+        self.__dict__['_lazy_module'] = None
+
+    def _load(self) -> types.ModuleType:
+        with self._lazy_lock:
+            if self._lazy_module is None:
+                module = importlib.import_module(self.__name__)
+                self.__dict__.update(module.__dict__)
+                self.__dict__['_lazy_module'] = module
+        return self._lazy_module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+
+def lazy_import(name: str):
+    """
+    Returns the module name without executing it. The module is loaded on the first attribute access, so
+    heavy packages (pandas, matplotlib, lxml, ...) only cost start-up time on the code paths which really use them.
+    Annotations using such modules need `from __future__ import annotations` to stay unevaluated.
+
+    :param name: absolute module name, for submodules the parent package is imported right away
+    :return: the module if it is imported already, else a placeholder loading it on first use (thread safe)
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    if importlib.util.find_spec(name) is None:
+        raise ModuleNotFoundError(f'No module named {name!r}', name=name)
+    return _LazyModule(name)
+
+
+def load(*modules) -> None:
+    """
+    Imports lazy modules right away, e.g. before starting threads which use them, so the first jobs do not all
+    wait for the same import.
+
+    :param modules: modules as returned by lazy_import
+    """
+    for module in modules:
+        if isinstance(module, _LazyModule):
+            module._load()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+import os
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+
+import mariadb
+
+from src.metrics import timed, inc
+from src import schema
+
+
+class MeasurementBuffer:
+    """
+    Append-only local SQLite buffer for measurements. Every sample is stored here first and later bulk-loaded
+    into wetter.messung, so readings survive a slow or unreachable MariaDB.
+    """
+    _TS_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+    def __init__(self, path: str):
+        """
+        Initialize with given SQLite file, creates it (and its directory) if necessary.
+
+        :param path: path of the SQLite file (e.g. on the SD card)
+        """
+        self._path = path
+        self._lock = threading.Lock()  # the scheduler samples and flushes from different threads
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute("""CREATE TABLE IF NOT EXISTS pending (
+                                zeit TEXT PRIMARY KEY,
+                                temperature REAL,
+                                pressure REAL,
+                                hell INTEGER)""")
+        self._db.commit()
+
+    @property
+    def path(self):
+        return self._path
+
+    def append(self, zeit: datetime, hell: bool, temperature: float, pressure: float) -> None:
+        """
+        Stores one sample. A second sample with the same timestamp (second precision) is ignored.
+
+        :param zeit: sample timestamp
+        :param hell: light intensity (boolean)
+        :param temperature: measured temperature
+        :param pressure: measured air pressure
+        :return: None
+        """
+        with self._lock:
+            self._db.execute('INSERT OR IGNORE INTO pending (zeit, temperature, pressure, hell) VALUES (?, ?, ?, ?)',
+                             (zeit.strftime(self._TS_FORMAT), temperature, pressure,
+                              None if hell is None else int(hell)))
+            self._db.commit()
+
+    def pending(self) -> int:
+        """
+        :return: number of samples not yet in MariaDB
+        """
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM pending').fetchone()[0]
+
+    @timed('buffer_flush')
+    def flush(self, con_: 'mariadb.connection', max_rows: int = 10000) -> int:
+        """
+        Bulk-loads the oldest pending samples into wetter.messung in one transaction and removes them from the
+        buffer afterwards. Samples whose timestamp already exists in messung (e.g. replayed after a crash between
+        the MariaDB commit and the buffer cleanup) are skipped.
+
+        :param con_: DB connection
+        :param max_rows: max. number of samples loaded per call
+        :return: number of samples removed from the buffer
+        :raises mariadb.Error: if the DB is not reachable, the samples stay in the buffer
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT zeit, temperature, pressure, hell FROM pending ORDER BY zeit LIMIT ?',
+                                    (max_rows,)).fetchall()
+        if not rows:
+            return 0
+
+        schema.migrate(con_)
+        cur = con_.cursor()
+        try:
+            cur.execute('SELECT zeit FROM wetter.messung WHERE zeit BETWEEN ? AND ?', (rows[0][0], rows[-1][0]))
+            existing = {zeit.strftime(self._TS_FORMAT) for zeit, in cur.fetchall()}
+            new_rows = [row for row in rows if row[0] not in existing]
+            if new_rows:
+                cur.executemany('INSERT INTO wetter.messung (zeit, temperature, pressure, hell) VALUES (?, ?, ?, ?)',
+                                new_rows)
+                schema.bump_generation(cur, 'messung')
+            con_.commit()
+        except mariadb.Error:
+            con_.rollback()
+            raise
+
+        with self._lock:
+            self._db.execute('DELETE FROM pending WHERE zeit <= ?', (rows[-1][0],))
+            self._db.commit()
+        inc('measurements_written', len(new_rows))
+        logging.info(f'Flushed {len(new_rows)} samples into wetter.messung '
+                     f'({len(rows) - len(new_rows)} duplicates skipped)')
+        return len(rows)
+
+    def flush_all(self, con_: 'mariadb.connection') -> int:
+        """
+        Flushes until the buffer is empty.
+
+        :param con_: DB connection
+        :return: number of samples removed from the buffer
+        """
+        total = 0
+        while True:
+            n = self.flush(con_)
+            if n == 0:
+                return total
+            total += n
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
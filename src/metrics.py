@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+import os
+import logging
+import cProfile
+import threading
+from time import perf_counter
+from datetime import datetime
+from functools import wraps
+from contextlib import contextmanager
+from typing import Optional
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Timer:
+    """
+    Context manager (and decorator) adding the duration of its block to an operation of a Metrics registry.
+    """
+    def __init__(self, metrics: 'Metrics', op: str):
+        self._metrics = metrics
+        self._op = op
+        self._start = None
+        self.seconds = None
+
+    def __enter__(self):
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.seconds = perf_counter() - self._start
+        self._metrics.observe(self._op, self.seconds, failed=exc_type is not None)
+        return False
+
+    def __call__(self, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Timer(self._metrics, self._op):  # fresh timer per call, decorated functions may run in threads
+                return func(*args, **kwargs)
+        return wrapper
+
+
+class Metrics:
+    """
+    Thread safe registry of operation timings and event counters, exported in the Prometheus text format, either
+    as file for the node_exporter textfile collector or via a small HTTP endpoint.
+    """
+    PREFIX = 'wetter'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timings = {}  # op -> [count, failures, sum, max, last]
+        self._counters = {}  # event -> count
+
+    def timed(self, op: str) -> _Timer:
+        """
+        Times a block (`with metrics.timed('op'):`) or every call of a function (`@metrics.timed('op')`).
+
+        :param op: operation name, used as label value
+        :return: timer
+        """
+        return _Timer(self, op)
+
+    def observe(self, op: str, seconds: float, failed: bool = False) -> None:
+        """
+        Adds one run of op, e.g. for durations measured in another process.
+
+        :param op: operation name
+        :param seconds: duration
+        :param failed: True if the run raised an exception
+        :return: None
+        """
+        with self._lock:
+            timing = self._timings.setdefault(op, [0, 0, 0., 0., 0.])
+            timing[0] += 1
+            timing[1] += int(failed)
+            timing[2] += seconds
+            timing[3] = max(timing[3], seconds)
+            timing[4] = seconds
+
+    def inc(self, event: str, n: int = 1) -> None:
+        """
+        Increases the counter of event by n.
+        """
+        with self._lock:
+            self._counters[event] = self._counters.get(event, 0) + n
+
+    def render(self, script: str) -> str:
+        """
+        :param script: value of the script label, keeps the series of several processes apart
+        :return: all metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            timings = {op: list(timing) for op, timing in self._timings.items()}
+            counters = dict(self._counters)
+
+        p = self.PREFIX
+        lines = [f'# HELP {p}_op_duration_seconds duration of the timed operations',
+                 f'# TYPE {p}_op_duration_seconds summary']
+        for op, timing in timings.items():
+            lines += [f'{p}_op_duration_seconds_count{{script="{script}",op="{op}"}} {timing[0]}',
+                      f'{p}_op_duration_seconds_sum{{script="{script}",op="{op}"}} {timing[2]:.6f}']
+        for name, kind, help_, index in ((f'{p}_op_failures_total', 'counter', 'runs which raised an exception', 1),
+                                         (f'{p}_op_duration_max_seconds', 'gauge', 'longest run', 3),
+                                         (f'{p}_op_duration_last_seconds', 'gauge', 'duration of the last run', 4)):
+            lines += [f'# HELP {name} {help_}', f'# TYPE {name} {kind}']
+            lines += [f'{name}{{script="{script}",op="{op}"}} {timing[index]:.6g}' for op, timing in timings.items()]
+        lines += [f'# HELP {p}_events_total events counted by the scripts', f'# TYPE {p}_events_total counter']
+        lines += [f'{p}_events_total{{script="{script}",event="{event}"}} {n}' for event, n in counters.items()]
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, directory: Optional[str], script: str) -> None:
+        """
+        Atomically (re)writes <directory>/wetter_<script>.prom, does nothing if directory is None.
+
+        :param directory: directory read by the node_exporter textfile collector
+        :param script: name of the script or process
+        :return: None
+        """
+        if directory is None:
+            return
+        path = os.path.join(directory, f'{self.PREFIX}_{script}.prom')
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(path + '.tmp', 'w') as f:
+                f.write(self.render(script))
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            logging.warning(f'could not write metrics to {path}: {e}')
+
+    def serve(self, address: tuple, script: str) -> ThreadingHTTPServer:
+        """
+        Serves the metrics on http://<address>/metrics from a daemon thread.
+
+        :param address: tuple (host, port), e.g. ('127.0.0.1', 9108)
+        :param script: name of the process
+        :return: the running server
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.render(script).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # keep the scrapes out of the log
+
+        server = ThreadingHTTPServer(address, Handler)
+        threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+        logging.info(f'serving metrics on {address[0] or "*"}:{server.server_address[1]}/metrics')
+        return server
+
+
+# registry shared by all modules of a process
+METRICS = Metrics()
+
+
+def timed(op: str) -> _Timer:
+    """
+    Times a block or function in the process wide registry, see Metrics.timed.
+    """
+    return METRICS.timed(op)
+
+
+def inc(event: str, n: int = 1) -> None:
+    """
+    Counts an event in the process wide registry.
+    """
+    METRICS.inc(event, n)
+
+
+@contextmanager
+def profiled(name: str, directory: Optional[str] = None):
+    """
+    Runs the block under cProfile and dumps the stats to <directory>/<name>_<timestamp>.prof (readable with
+    pstats or snakeviz). Without directory the block runs unprofiled.
+
+    :param name: prefix of the dump file
+    :param directory: target directory, None disables profiling
+    """
+    if directory is None:
+        yield
+        return
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError as e:  # only one profiler can be active at a time (python >= 3.12)
+        logging.warning(f'{name} not profiled: {e}')
+        profile = None
+    if profile is None:
+        yield
+        return
+    try:
+        yield
+    finally:
+        profile.disable()
+        path = os.path.join(directory, f'{name}_{datetime.now().strftime("%Y%m%d-%H%M%S")}.prof')
+        try:
+            os.makedirs(directory, exist_ok=True)
+            profile.dump_stats(path)
+            logging.info(f'profile written to {path}')
+        except OSError as e:
+            logging.warning(f'could not write profile {path}: {e}')
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import os
+import logging
+from datetime import datetime
+from time import perf_counter
+from typing import Optional
+
+import mariadb
+
+from src.lazy import lazy_import
+from src.metrics import timed
+from src.dtypes import MESSUNG, compact
+from src import schema
+
+pd = lazy_import('pandas')
+
+
+class Rollup:
+    """
+    Class used to keep an aggregate table of wetter.messung up to date incrementally.
+
+    The newest messung id that was aggregated is kept in wetter.rollup_state. Each refresh only reads the rows
+    added since then, determines the buckets they fall into and recomputes just these buckets from the raw data,
+    so late arriving samples (e.g. replayed from the measurement buffer) end up in the right bucket.
+    """
+    COLUMNS = ('temperature', 'pressure', 'hell')
+    STATS = ('min', 'mean', 'max', 'median')
+
+    def __init__(self, con: 'mariadb.connection', table: str = 'messung_30min', freq: str = '30min'):
+        """
+        Initialize with given connection and bucket size.
+
+        :param con: Maria DB connection
+        :param table: name of the aggregate table in schema wetter
+        :param freq: pandas frequency of the buckets
+        """
+        self._con = con
+        self._table = table
+        self._freq = freq
+        self._ensure_tables()
+
+    @property
+    def con(self):
+        return self._con
+
+    @property
+    def table(self):
+        return self._table
+
+    @property
+    def freq(self):
+        return self._freq
+
+    @property
+    def agg_columns(self) -> list:
+        return [f'{col}_{stat}' for col in self.COLUMNS for stat in self.STATS]
+
+    def _ensure_tables(self) -> None:
+        cur = self._con.cursor()
+        cur.execute("""CREATE TABLE IF NOT EXISTS wetter.rollup_state (
+                           name VARCHAR(64) PRIMARY KEY,
+                           last_id BIGINT NOT NULL)""")
+        cur.execute(f"""CREATE TABLE IF NOT EXISTS wetter.{self._table} (
+                            bucket DATETIME PRIMARY KEY,
+                            n INT NOT NULL,
+                            {', '.join(f'{c} FLOAT' for c in self.agg_columns)})""")
+        self._con.commit()
+
+    def _last_id(self) -> int:
+        cur = self._con.cursor()
+        cur.execute('SELECT last_id FROM wetter.rollup_state WHERE name = ?', (self._table,))
+        row = cur.fetchone()
+        return row[0] if row else 0
+
+    def aggregate(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Aggregates raw measurements into buckets.
+
+        :param df: raw data with columns zeit, temperature, pressure, hell
+        :return: frame indexed by bucket with column n and one column per column/statistic, empty buckets dropped
+        """
+        resampled = df.set_index('zeit')[list(self.COLUMNS)].astype(float).resample(self._freq)
+        agg = resampled.agg(list(self.STATS))
+        agg.columns = [f'{col}_{stat}' for col, stat in agg.columns]
+        agg.insert(0, 'n', resampled['temperature'].size())
+        agg.index.name = 'bucket'
+        return agg.loc[agg['n'] > 0]
+
+    @timed('rollup_refresh')
+    def refresh(self, chunk_rows: int = 50000) -> int:
+        """
+        Aggregates all measurements added since the last refresh and upserts the affected buckets. The new rows are
+        read in id ranges of at most chunk_rows, each range is committed together with its last id, so the first
+        refresh of a tier backfills years of history with bounded memory and an interrupted backfill resumes.
+
+        :param chunk_rows: new raw rows read per transaction
+        :return: number of buckets written
+        """
+        start = perf_counter()
+        last_id = self._last_id()
+        written = rows_read = 0
+        while True:
+            new = pd.read_sql(con=self._con, sql='SELECT id, zeit FROM wetter.messung WHERE id > ? ORDER BY id LIMIT ?',
+                              params=(last_id, chunk_rows))
+            if new.empty:
+                break
+            chunk_written = self._refresh_buckets(new)
+            if chunk_written is None:
+                break
+            last_id = int(new['id'].max())
+            written += chunk_written
+            rows_read += len(new)
+            if len(new) < chunk_rows:
+                break
+        if rows_read:
+            logging.info(f'{self._table}: {written} buckets from {rows_read} new rows in {perf_counter() - start:.3f}s')
+        return written
+
+    def _refresh_buckets(self, new: pd.DataFrame) -> Optional[int]:
+        """
+        Recomputes the buckets of the given new rows from the raw data and stores them with the last id.
+
+        :param new: frame with columns id, zeit of new raw rows
+        :return: number of buckets written, None on DB errors
+        """
+        buckets = pd.to_datetime(new['zeit']).dt.floor(self._freq).unique()
+        raw = pd.read_sql(con=self._con,
+                          sql="""SELECT zeit, temperature, pressure, hell FROM wetter.messung
+                                 WHERE zeit >= ? AND zeit < ?""",
+                          params=(buckets.min().to_pydatetime(),
+                                  (buckets.max() + pd.Timedelta(self._freq)).to_pydatetime()))
+        agg = self.aggregate(raw)
+        agg = agg.loc[agg.index.isin(buckets)].reset_index()
+        agg['bucket'] = agg['bucket'].dt.strftime('%Y-%m-%d %H:%M:%S')
+        rows = list(agg.astype(object).where(agg.notna(), None).itertuples(index=False, name=None))
+
+        columns = ['bucket', 'n'] + self.agg_columns
+        cur = self._con.cursor()
+        try:
+            if rows:
+                cur.executemany(f"""INSERT INTO wetter.{self._table} ({', '.join(columns)})
+                                    VALUES ({', '.join('?' * len(columns))})
+                                    ON DUPLICATE KEY UPDATE {', '.join(f'{c} = VALUES({c})' for c in columns[1:])}""",
+                                rows)
+            cur.execute("""INSERT INTO wetter.rollup_state (name, last_id) VALUES (?, ?)
+                           ON DUPLICATE KEY UPDATE last_id = VALUES(last_id)""",
+                        (self._table, int(new['id'].max())))
+            if rows:
+                schema.bump_generation(cur, 'rollup')
+            self._con.commit()
+        except mariadb.Error as e:
+            logging.error(f'Error when refreshing {self._table}: {e}')
+            self._con.rollback()
+            return None
+        return len(rows)
+
+    def load(self, since: datetime, stat: dict = None, until: datetime = None) -> pd.DataFrame:
+        """
+        Reads aggregated measurements, see load_tier.
+        """
+        return load_tier(self._con, self._table, since, stat, until)
+
+
+def load_tier(con: 'mariadb.connection', table: str, since: datetime, stat: dict = None,
+              until: datetime = None) -> pd.DataFrame:
+    """
+    Reads aggregated measurements of a tier, only a SELECT (no table creation and no refresh).
+
+    :param con: Maria DB connection
+    :param table: name of the aggregate table in schema wetter
+    :param since: first bucket to be returned
+    :param stat: statistic per column, default mean for temperature/pressure and median for hell
+    :param until: if given, only buckets before until are returned
+    :return: frame with columns zeit, temperature, pressure, hell (one row per bucket, float32 values)
+    """
+    stat = stat or {'temperature': 'mean', 'pressure': 'mean', 'hell': 'median'}
+    columns = ', '.join(f'{c}_{s} AS {c}' for c, s in stat.items())
+    return compact(pd.read_sql(con=con,
+                               sql=f"""SELECT bucket AS zeit, {columns}
+                                       FROM wetter.{table}
+                                       WHERE bucket >= ?{' AND bucket < ?' if until is not None else ''}
+                                       ORDER BY bucket""",
+                               params=(since,) if until is None else (since, until)),
+                   MESSUNG)
+
+
+# (table, bucket size) from fine to coarse
+TIERS = [('messung_1min', '1min'),
+         ('messung_30min', '30min'),
+         ('messung_1h', '1h'),
+         ('messung_1d', '1D')]
+
+
+def refresh_all(con: 'mariadb.connection') -> dict:
+    """
+    Refreshes all rollup tiers incrementally.
+
+    :param con: Maria DB connection
+    :return: dict table -> number of buckets written
+    """
+    return {table: Rollup(con, table, freq).refresh() for table, freq in TIERS}
+
+
+def select_tier(since: datetime, resolution: str, retention_days: dict = None) -> (str, str):
+    """
+    Picks the coarsest tier which still resolves the requested resolution and holds data back to since.
+
+    :param since: start of the requested window
+    :param resolution: pandas frequency the caller needs, e.g. '30min'
+    :param retention_days: dict table -> days kept (tables not given keep everything)
+    :return: tuple (table, bucket size)
+    """
+    retention_days = retention_days or {}
+    retained = [(table, freq) for table, freq in TIERS
+                if table not in retention_days or since >= datetime.now() - pd.Timedelta(days=retention_days[table])]
+    retained = retained or TIERS[-1:]
+    resolving = [(table, freq) for table, freq in retained if pd.Timedelta(freq) <= pd.Timedelta(resolution)]
+    return resolving[-1] if resolving else retained[0]
+
+
+def _delete_before(con: 'mariadb.connection', table: str, column: str, cutoff: datetime, chunk: int = 10000) -> int:
+    cur = con.cursor()
+    deleted = 0
+    while True:
+        cur.execute(f'DELETE FROM wetter.{table} WHERE {column} < ? LIMIT {chunk}', (cutoff,))
+        con.commit()
+        deleted += cur.rowcount
+        if cur.rowcount < chunk:
+            return deleted
+
+
+def apply_retention(con: 'mariadb.connection', raw_days: int, tier_days: dict = None,
+                    archive_dir: str = None) -> None:
+    """
+    Removes raw measurements (and optionally fine tiers) older than the configured number of days. The tiers have
+    to be refreshed first (see rollup_maintenance.py), so the removed rows are kept in downsampled form. The cutoff
+    is aligned to midnight, so no bucket of the daily tier loses part of its raw rows. The raw rows are archived
+    and deleted one day at a time, the oldest first.
+
+    :param con: Maria DB connection
+    :param raw_days: days of raw wetter.messung rows to keep (at least 2)
+    :param tier_days: dict tier table -> days to keep, tiers not given are kept forever
+    :param archive_dir: if given, removed raw rows are written there as one gzip csv per day first
+    :return: None
+    """
+    cutoff = pd.Timestamp.now().floor('D') - pd.Timedelta(days=max(2, raw_days))
+    if archive_dir is not None:
+        os.makedirs(archive_dir, exist_ok=True)
+
+    cur = con.cursor()
+    deleted = 0
+    while True:
+        cur.execute('SELECT MIN(zeit) FROM wetter.messung WHERE zeit < ?', (cutoff.to_pydatetime(),))
+        first = cur.fetchone()[0]
+        if first is None:
+            break
+        day = pd.Timestamp(first).floor('D')
+        day_end = min(day + pd.Timedelta(days=1), cutoff)
+        if archive_dir is not None:
+            df_day = pd.read_sql(con=con, sql='SELECT id, zeit, temperature, pressure, hell FROM wetter.messung '
+                                              'WHERE zeit >= ? AND zeit < ? ORDER BY zeit',
+                                 params=(day.to_pydatetime(), day_end.to_pydatetime()))
+            path = os.path.join(archive_dir, f'messung_{day.date()}.csv.gz')
+            try:
+                df_day.to_csv(path, index=False, mode='a', header=not os.path.exists(path))
+            except OSError as e:
+                logging.error(f'could not archive {day.date()} to {path}, raw rows kept: {e}')
+                break
+        deleted += _delete_before(con, 'messung', 'zeit', day_end.to_pydatetime())
+    logging.info(f'deleted {deleted} raw rows before {cutoff}')
+
+    for table, days in (tier_days or {}).items():
+        tier_cutoff = pd.Timestamp.now().floor('D') - pd.Timedelta(days=days)
+        logging.info(f'deleted {_delete_before(con, table, "bucket", tier_cutoff.to_pydatetime())} rows of {table} '
+                     f'before {tier_cutoff}')
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+import statistics
+from time import sleep, monotonic
+from typing import Callable, Optional
+
+# scale factor of the median absolute deviation to the standard deviation of normally distributed noise
+_MAD_TO_SIGMA = 1.4826
+
+
+def retry(func: Callable, tries: int = 5, deadline_s: float = 3., first_delay_s: float = .05, factor: float = 2.,
+          max_delay_s: float = 1., **kwargs) -> tuple:
+    """
+    Calls func until it returns something else than None. Waits first_delay_s after the first failure and factor
+    times longer after each further one (at most max_delay_s), gives up after tries retries or when the next attempt
+    would start after deadline_s.
+
+    :param func: function returning None if it failed
+    :param tries: maximum number of retries after the first call
+    :param deadline_s: seconds after which no further attempt is started
+    :param first_delay_s: first wait
+    :param factor: growth of the wait per failure
+    :param max_delay_s: longest wait
+    :param kwargs: passed to func
+    :return: tuple (last result of func, number of retries)
+    """
+    deadline = monotonic() + deadline_s
+    delay = first_delay_s
+    val = func(**kwargs)
+    retries = 0
+    while val is None and retries < tries:
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            break
+        sleep(min(delay, remaining))
+        val = func(**kwargs)
+        retries += 1
+        delay = min(delay * factor, max_delay_s)
+    return val, retries
+
+
+def robust_median(values: list, max_sigma: float = 3., min_deviation: float = 0.) -> (Optional[float], int):
+    """
+    Median of a burst of samples without outliers: samples deviating more than max_sigma robust standard deviations
+    (derived from the median absolute deviation) from the median are dropped before the median is taken.
+
+    :param values: samples, None entries are ignored
+    :param max_sigma: rejection threshold
+    :param min_deviation: samples closer to the median than this are always kept, e.g. a few sensor resolution
+     steps, so jitter is not rejected when most samples are equal (median absolute deviation 0)
+    :return: tuple (median or None if there is no sample, number of rejected samples)
+    """
+    values = [val for val in values if val is not None]
+    if not values:
+        return None, 0
+    median = statistics.median(values)
+    mad = statistics.median(abs(val - median) for val in values)
+    limit = max(max_sigma * _MAD_TO_SIGMA * mad, min_deviation)
+    kept = [val for val in values if abs(val - median) <= limit] if limit > 0 else values
+    return statistics.median(kept), len(values) - len(kept)
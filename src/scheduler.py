@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import threading
+from time import monotonic, perf_counter
+from datetime import datetime
+from typing import Callable, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+import mariadb
+
+from src.metrics import METRICS, timed, profiled
+
+
+class Job:
+    """
+    A periodic job of the scheduler. func gets a pooled DB connection (or None if needs_db is False) and returns
+    True if it produced new data, which triggers the jobs chained after it.
+    """
+    def __init__(self, name: str, func: Callable, interval: float, needs_db: bool = True, after: tuple = (),
+                 delay: float = 0.):
+        """
+        :param name: unique job name
+        :param func: callable func(con) -> Optional[bool]
+        :param interval: seconds between two runs, None for jobs which only run when triggered
+        :param needs_db: if True, func gets a connection from the pool, which is returned afterwards
+        :param after: names of jobs whose new data trigger an immediate run of this job
+        :param delay: seconds from now to the first run, staggers the jobs when the scheduler starts
+        """
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.needs_db = needs_db
+        self.after = tuple(after)
+        self.next_run = monotonic() + delay if interval is not None else float('inf')
+        self.running = False
+        self.triggered = False
+        self.runs = 0
+        self.failures = 0
+        self.last_start = None
+        self.last_duration = None
+        self.last_outcome = None
+
+    def status(self) -> dict:
+        return {'runs': self.runs,
+                'failures': self.failures,
+                'running': self.running,
+                'last_start': self.last_start,
+                'last_duration_s': self.last_duration,
+                'last_outcome': self.last_outcome}
+
+
+class Scheduler:
+    """
+    Runs registered jobs in a thread pool on a shared MariaDB connection pool. A job never overlaps with itself,
+    I/O bound jobs run concurrently, and jobs chained with `after` run right after their predecessor wrote new data.
+    """
+    def __init__(self, pool: 'mariadb.ConnectionPool', workers: int = 4, status_path: Optional[str] = None,
+                 metrics_dir: Optional[str] = None, profile_dir: Optional[str] = None):
+        """
+        :param pool: MariaDB connection pool
+        :param workers: number of jobs running at the same time
+        :param status_path: json file the job status is written to after each run
+        :param metrics_dir: directory of the node_exporter textfile collector, metrics are written after each run
+        :param profile_dir: if given, every job run is profiled with cProfile and dumped there
+        """
+        self._pool = pool
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._status_path = status_path
+        self._metrics_dir = metrics_dir
+        self._profile_dir = profile_dir
+        self._jobs = {}
+        self._wakeup = threading.Condition()
+
+    @property
+    def jobs(self):
+        return self._jobs
+
+    def add(self, job: Job) -> None:
+        self._jobs[job.name] = job
+
+    def trigger(self, name: str) -> None:
+        """
+        Runs job name as soon as possible.
+        """
+        with self._wakeup:
+            self._trigger(self._jobs[name])
+            self._wakeup.notify()
+
+    @staticmethod
+    def _trigger(job: Job) -> None:
+        if job.running:
+            job.triggered = True  # run again right after the current run
+        else:
+            job.next_run = monotonic()
+
+    def status(self) -> dict:
+        return {name: job.status() for name, job in self._jobs.items()}
+
+    def _run(self, job: Job) -> None:
+        start = perf_counter()
+        job.last_start = datetime.now().isoformat(timespec='seconds')
+        new_data = False
+        try:
+            with timed(f'job_{job.name}'), profiled(job.name, self._profile_dir):
+                if job.needs_db:
+                    con = self._pool.get_connection()
+                    try:
+                        new_data = bool(job.func(con))
+                    finally:
+                        try:
+                            con.close()  # returns the connection to the pool
+                        except mariadb.Error:
+                            pass
+                else:
+                    new_data = bool(job.func(None))
+            job.last_outcome = 'new data' if new_data else 'ok'
+        except Exception as e:
+            job.failures += 1
+            job.last_outcome = f'error: {e}'
+            logging.exception(f'job {job.name} failed')
+        job.runs += 1
+        job.last_duration = round(perf_counter() - start, 3)
+        logging.info(f'job {job.name}: {job.last_outcome} in {job.last_duration}s')
+
+        with self._wakeup:
+            job.running = False
+            if job.triggered:
+                job.triggered = False
+                job.next_run = monotonic()
+            elif job.interval is not None:
+                job.next_run = monotonic() + job.interval
+            if new_data:
+                for other in self._jobs.values():
+                    if job.name in other.after:
+                        self._trigger(other)
+            self._write_status()
+            METRICS.write_textfile(self._metrics_dir, 'scheduler')
+            self._wakeup.notify()
+
+    def _write_status(self) -> None:
+        if self._status_path is None:
+            return
+        try:
+            with open(self._status_path, 'w') as f:
+                json.dump(self.status(), f, indent=2)
+        except OSError as e:
+            logging.warning(f'could not write scheduler status: {e}')
+
+    def run_forever(self) -> None:
+        """
+        Starts due jobs until the process is stopped.
+        """
+        logging.info(f'scheduler started with jobs {", ".join(self._jobs)}')
+        try:
+            while True:
+                with self._wakeup:
+                    now = monotonic()
+                    for job in self._jobs.values():
+                        if not job.running and job.next_run <= now:
+                            job.running = True
+                            job.next_run = float('inf')
+                            self._executor.submit(self._run, job)
+                    next_run = min((job.next_run for job in self._jobs.values() if not job.running), default=now + 60)
+                    self._wakeup.wait(timeout=min(60., max(0., next_run - now)))
+        finally:
+            self._executor.shutdown(wait=True)
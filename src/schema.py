@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+import sys
+import logging
+import mariadb
+from datetime import datetime
+
+# (version, description, statements) - append only, applied migrations are recorded in wetter.schema_migrations
+MIGRATIONS = [
+    (1, 'unique key used by the forecast upsert',
+     ['CREATE UNIQUE INDEX IF NOT EXISTS forecast_dwd_station_ts ON wetter.forecast_dwd (station_id, ts)']),
+    (2, 'time range scans on messung (graph, buffer flush, rollups, retention)',
+     ['CREATE INDEX IF NOT EXISTS messung_zeit ON wetter.messung (zeit)']),
+    (3, 'forecast history and issue log',
+     ["""CREATE TABLE IF NOT EXISTS wetter.forecast_dwd_history (
+             station_id VARCHAR(8) NOT NULL,
+             issue_time DATETIME NOT NULL,
+             ts DATETIME NOT NULL,
+             temperatur FLOAT, druck FLOAT, wind_max_1h FLOAT, ww FLOAT, sonnenscheinminuten FLOAT, wolken FLOAT,
+             p_regen FLOAT, niederschlag_1h FLOAT, wind FLOAT, temperatur_boden FLOAT, sonnenstrahlung FLOAT,
+             PRIMARY KEY (station_id, ts, issue_time))""",
+      """CREATE TABLE IF NOT EXISTS wetter.forecast_dwd_issue (
+             station_id VARCHAR(8) NOT NULL,
+             issue_time DATETIME NOT NULL,
+             loaded_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+             n_rows INT NOT NULL,
+             n_changed INT NOT NULL,
+             PRIMARY KEY (station_id, issue_time))"""]),
+    (4, 'data generations, bumped by the loaders to invalidate cached query results',
+     ["""CREATE TABLE IF NOT EXISTS wetter.data_generation (
+             name VARCHAR(32) PRIMARY KEY,
+             generation BIGINT NOT NULL,
+             changed_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP)"""]),
+    (5, 'text forecast stored as deduplicated sections',
+     ["""CREATE TABLE IF NOT EXISTS wetter.forecast_text_section (
+             hash CHAR(64) NOT NULL PRIMARY KEY,
+             heading VARCHAR(255) NOT NULL,
+             body TEXT NOT NULL)""",
+      """CREATE TABLE IF NOT EXISTS wetter.forecast_text_issue (
+             page_hash CHAR(64) NOT NULL PRIMARY KEY,
+             loaded_at DATETIME NOT NULL,
+             issue_time DATETIME)""",
+      """CREATE TABLE IF NOT EXISTS wetter.forecast_text_issue_section (
+             page_hash CHAR(64) NOT NULL,
+             position SMALLINT NOT NULL,
+             section_hash CHAR(64) NOT NULL,
+             PRIMARY KEY (page_hash, position))""",
+      'CREATE INDEX IF NOT EXISTS forecast_text_issue_loaded ON wetter.forecast_text_issue (loaded_at)']),
+    (6, 'forecast verification: error sums per station, variable, lead time and issue hour, per day, state',
+     ["""CREATE TABLE IF NOT EXISTS wetter.forecast_skill (
+             station_id VARCHAR(8) NOT NULL,
+             variable VARCHAR(16) NOT NULL,
+             lead_h SMALLINT NOT NULL,
+             issue_hour TINYINT NOT NULL,
+             n INT NOT NULL, sum_err DOUBLE NOT NULL, sum_abs_err DOUBLE NOT NULL, sum_sq_err DOUBLE NOT NULL,
+             PRIMARY KEY (station_id, variable, lead_h, issue_hour))""",
+      """CREATE TABLE IF NOT EXISTS wetter.forecast_skill_daily (
+             day DATE NOT NULL,
+             station_id VARCHAR(8) NOT NULL,
+             variable VARCHAR(16) NOT NULL,
+             n INT NOT NULL, sum_err DOUBLE NOT NULL, sum_abs_err DOUBLE NOT NULL, sum_sq_err DOUBLE NOT NULL,
+             PRIMARY KEY (day, station_id, variable))""",
+      """CREATE TABLE IF NOT EXISTS wetter.verification_state (
+             name VARCHAR(64) NOT NULL PRIMARY KEY,
+             last_ts DATETIME NOT NULL)"""]),
+    (7, 'blended, bias corrected forecast of all stations',
+     ["""CREATE TABLE IF NOT EXISTS wetter.forecast_blend (
+             ts DATETIME NOT NULL PRIMARY KEY,
+             issue_time DATETIME NOT NULL,
+             last_update DATETIME,
+             temperatur FLOAT, druck FLOAT, sonnenscheinminuten FLOAT, wind_max_1h FLOAT, wind FLOAT,
+             niederschlag_1h FLOAT, p_regen FLOAT, ww SMALLINT,
+             temperatur_bias FLOAT, druck_bias FLOAT)""",
+      'CREATE INDEX IF NOT EXISTS forecast_blend_issue ON wetter.forecast_blend (issue_time)']),
+    (8, 'number of distinct verified hours per day in forecast_skill_daily (n counts pairs of all issues)',
+     ['ALTER TABLE wetter.forecast_skill_daily ADD COLUMN hours INT NOT NULL DEFAULT 0']),
+]
+
+# table -> index name -> columns, checked by verify
+INDEXES = {'messung': {'messung_zeit': ['zeit']},
+           'forecast_dwd': {'forecast_dwd_station_ts': ['station_id', 'ts']},
+           'forecast_dwd_history': {'PRIMARY': ['station_id', 'ts', 'issue_time']},
+           'forecast_dwd_issue': {'PRIMARY': ['station_id', 'issue_time']},
+           'forecast_text_issue': {'PRIMARY': ['page_hash'], 'forecast_text_issue_loaded': ['loaded_at']},
+           'forecast_text_section': {'PRIMARY': ['hash']},
+           'forecast_skill': {'PRIMARY': ['station_id', 'variable', 'lead_h', 'issue_hour']},
+           'forecast_blend': {'PRIMARY': ['ts'], 'forecast_blend_issue': ['issue_time']}}
+
+_migrated = False
+
+
+def version(con: 'mariadb.connection') -> int:
+    """
+    :param con: Maria DB connection
+    :return: latest applied migration, 0 for none
+    """
+    cur = con.cursor()
+    cur.execute("""CREATE TABLE IF NOT EXISTS wetter.schema_migrations (
+                       version INT PRIMARY KEY,
+                       description VARCHAR(255),
+                       applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP)""")
+    cur.execute('SELECT MAX(version) FROM wetter.schema_migrations')
+    return cur.fetchone()[0] or 0
+
+
+def migrate(con: 'mariadb.connection', force: bool = False) -> int:
+    """
+    Applies all migrations newer than the recorded version. Only the first call per process queries the DB.
+
+    :param con: Maria DB connection
+    :param force: check again even if this process already migrated
+    :return: number of migrations applied
+    """
+    global _migrated
+    if _migrated and not force:
+        return 0
+    current = version(con)
+    applied = 0
+    for number, description, statements in MIGRATIONS:
+        if number <= current:
+            continue
+        logging.info(f'schema migration {number}: {description}')
+        cur = con.cursor()
+        for statement in statements:
+            cur.execute(statement)
+        cur.execute('INSERT INTO wetter.schema_migrations (version, description) VALUES (?, ?)',
+                    (number, description))
+        con.commit()
+        applied += 1
+    _migrated = True
+    return applied
+
+
+def bump_generation(cur: 'mariadb.cursor', name: str) -> None:
+    """
+    Increases the generation of a data source (e.g. 'messung', 'forecast') as part of the caller's transaction, so
+    readers caching query results see the new data once it is committed.
+
+    :param cur: cursor of the writing transaction
+    :param name: data source
+    :return: None
+    """
+    cur.execute("""INSERT INTO wetter.data_generation (name, generation, changed_at) VALUES (?, 1, ?)
+                   ON DUPLICATE KEY UPDATE generation = generation + 1, changed_at = VALUES(changed_at)""",
+                (name, datetime.now().replace(microsecond=0)))
+
+
+def generations(con: 'mariadb.connection') -> dict:
+    """
+    :param con: Maria DB connection
+    :return: dict data source -> generation, sources never written are missing
+    """
+    cur = con.cursor()
+    cur.execute('SELECT name, generation FROM wetter.data_generation')
+    return dict(cur.fetchall())
+
+
+def verify(con: 'mariadb.connection') -> list:
+    """
+    Compares the indexes in information_schema with INDEXES.
+
+    :param con: Maria DB connection
+    :return: list of problems (missing indexes or different columns), empty if everything is in place
+    """
+    cur = con.cursor()
+    cur.execute(f"""SELECT table_name, index_name, column_name FROM information_schema.statistics
+                    WHERE table_schema = 'wetter' AND table_name IN ({', '.join('?' * len(INDEXES))})
+                    ORDER BY table_name, index_name, seq_in_index""", tuple(INDEXES))
+    found = {}
+    for table, index, column in cur.fetchall():
+        found.setdefault((table, index), []).append(column)
+
+    problems = []
+    for table, indexes in INDEXES.items():
+        for index, columns in indexes.items():
+            if (table, index) not in found:
+                problems.append(f'{table}: index {index} ({", ".join(columns)}) missing')
+            elif found[(table, index)] != columns:
+                problems.append(f'{table}: index {index} is on ({", ".join(found[(table, index)])}), '
+                                f'expected ({", ".join(columns)})')
+    return problems
+
+
+if __name__ == '__main__':
+    import public_passwords as pw
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    try:
+        con_ = mariadb.connect(database='wetter', **pw.mariadb_cred)
+    except mariadb.Error as e:
+        logging.error(f'Error connecting to MariaDB Platform: {e}')
+        sys.exit(1)
+    logging.info(f'{migrate(con_)} migrations applied, schema version {version(con_)}')
+    issues = verify(con_)
+    for issue in issues:
+        logging.error(issue)
+    con_.close()
+    sys.exit(1 if issues else 0)
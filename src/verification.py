@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import logging
+from time import perf_counter
+from typing import Optional
+
+import mariadb
+
+from src.lazy import lazy_import
+from src.metrics import timed, inc
+from src.rollup import Rollup
+from src import schema
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# forecast column -> measured column
+VARIABLES = {'temperatur': 'temperature', 'druck': 'pressure'}
+# longest lead time of the MOSMIX products in hours
+MAX_LEAD_H = 240
+_SUMS = ['n', 'sum_err', 'sum_abs_err', 'sum_sq_err']
+_GROUPS = ('station_id', 'variable', 'lead_h', 'issue_hour')
+_DAILY = ['day', 'station_id', 'variable']
+
+
+class Verifier:
+    """
+    Class used to verify the stored forecasts against the measurements, incrementally.
+
+    Every forecast issue in wetter.forecast_dwd_issue is reconstructed from wetter.forecast_dwd_history (the version
+    of a (station_id, ts) in effect for an issue is the latest one not newer than the issue, found with merge_asof)
+    and paired with the hourly mean of the measurements of the hour ending at ts (wetter.messung_1h). Error sums
+    per station, variable, lead time and issue hour (wetter.forecast_skill) and per day (forecast_skill_daily)
+    are accumulated, only hours newer than the last run (wetter.verification_state) are read.
+    """
+    STATE = 'forecast_skill'
+
+    def __init__(self, con: 'mariadb.connection', station_ids: list, local_tz: str = 'Europe/Berlin',
+                 delay_h: int = 3, backfill_days: int = 30, chunk_days: int = 7):
+        """
+        :param con: Maria DB connection
+        :param station_ids: dwd stations to be verified
+        :param local_tz: time zone of the measurement timestamps (forecasts are UTC)
+        :param delay_h: hours an hour is left open for late measurements (e.g. replayed from the buffer)
+        :param backfill_days: days verified by the first run
+        :param chunk_days: days verified per transaction
+        """
+        self._con = con
+        self._station_ids = list(station_ids)
+        self._tz = local_tz
+        self._delay = pd.Timedelta(hours=delay_h)
+        self._backfill = pd.Timedelta(days=backfill_days)
+        self._chunk = pd.Timedelta(days=chunk_days)
+
+    def _last_ts(self) -> Optional[pd.Timestamp]:
+        cur = self._con.cursor()
+        cur.execute('SELECT last_ts FROM wetter.verification_state WHERE name = ?', (self.STATE,))
+        row = cur.fetchone()
+        return pd.Timestamp(row[0]) if row else None
+
+    def observations(self, start: pd.Timestamp, end: pd.Timestamp) -> pd.DataFrame:
+        """
+        :param start: exclusive start (UTC)
+        :param end: inclusive end (UTC)
+        :return: frame with column ts (UTC, end of the hour) and the measured hourly means, sorted by ts
+        """
+        tier = Rollup(self._con, 'messung_1h', '1h')
+        tier.refresh()
+        margin = pd.Timedelta(hours=15)  # local time is at most 14 hours off UTC
+        obs = tier.load(since=(start - margin).to_pydatetime(), until=(end + margin).to_pydatetime())
+        obs['ts'] = ((obs['zeit'] + pd.Timedelta(hours=1))
+                     .dt.tz_localize(self._tz, ambiguous='NaT', nonexistent='NaT')
+                     .dt.tz_convert('UTC')
+                     .dt.tz_localize(None)
+                     .astype('datetime64[ns]'))
+        obs = obs.loc[(obs['ts'] > start) & (obs['ts'] <= end), ['ts'] + list(VARIABLES.values())]
+        return obs.sort_values('ts')
+
+    def forecasts(self, start: pd.Timestamp, end: pd.Timestamp) -> pd.DataFrame:
+        """
+        Reconstructs the forecasts of all issues for the timestamps in (start, end].
+
+        :return: frame with columns station_id, ts, issue_time, lead_h, issue_hour and the forecast values
+        """
+        stations = ', '.join('?' * len(self._station_ids))
+        history = pd.read_sql(con=self._con,
+                              sql=f"""SELECT station_id, ts, issue_time AS version, {', '.join(VARIABLES)}
+                                      FROM wetter.forecast_dwd_history
+                                      WHERE station_id IN ({stations}) AND ts > ? AND ts <= ?""",
+                              params=(*self._station_ids, start.to_pydatetime(), end.to_pydatetime()))
+        issues = pd.read_sql(con=self._con,
+                             sql=f"""SELECT station_id, issue_time FROM wetter.forecast_dwd_issue
+                                     WHERE station_id IN ({stations}) AND issue_time >= ? AND issue_time < ?""",
+                             params=(*self._station_ids, (start - pd.Timedelta(hours=MAX_LEAD_H)).to_pydatetime(),
+                                     end.to_pydatetime()))
+        if history.empty or issues.empty:
+            return pd.DataFrame(columns=['station_id', 'ts', 'issue_time', 'lead_h', 'issue_hour', *VARIABLES])
+        for df, col in ((history, 'ts'), (history, 'version'), (issues, 'issue_time')):
+            df[col] = pd.to_datetime(df[col]).astype('datetime64[ns]')
+        for df in (history, issues):
+            df['station_id'] = df['station_id'].astype(str)
+
+        # every (station, ts) with every issue of the station which covers ts
+        pairs = history[['station_id', 'ts']].drop_duplicates().merge(issues, on='station_id')
+        lead = (pairs['ts'] - pairs['issue_time']) / pd.Timedelta(hours=1)
+        pairs = pairs.loc[(lead >= 1) & (lead <= MAX_LEAD_H)]
+        # version in effect for the issue: the latest stored one not newer than the issue
+        pairs = pd.merge_asof(pairs.sort_values('issue_time'), history.sort_values('version'),
+                              left_on='issue_time', right_on='version', by=['station_id', 'ts'],
+                              direction='backward')
+        pairs = pairs.dropna(subset=['version'])
+        pairs['lead_h'] = ((pairs['ts'] - pairs['issue_time']) / pd.Timedelta(hours=1)).round().astype('int16')
+        pairs['issue_hour'] = pairs['issue_time'].dt.hour.astype('int8')
+        return pairs.drop(columns='version')
+
+    @staticmethod
+    def errors(fc: pd.DataFrame, obs: pd.DataFrame) -> pd.DataFrame:
+        """
+        Aligns forecasts with the observation of their timestamp and computes the errors (forecast - observed).
+
+        :return: long frame with columns station_id, ts, lead_h, issue_hour, variable, err
+        """
+        pairs = pd.merge_asof(fc.sort_values('ts'), obs, on='ts', direction='nearest',
+                              tolerance=pd.Timedelta(minutes=1))
+        keys = ['station_id', 'ts', 'lead_h', 'issue_hour']
+        frames = []
+        for fc_col, obs_col in VARIABLES.items():
+            err = pairs[fc_col].to_numpy(dtype='float64') - pairs[obs_col].to_numpy(dtype='float64')
+            valid = ~np.isnan(err)
+            frames.append(pairs.loc[valid, keys].assign(variable=fc_col, err=err[valid]))
+        return pd.concat(frames, ignore_index=True)
+
+    @staticmethod
+    def sums(errors: pd.DataFrame, by: list) -> pd.DataFrame:
+        """
+        :return: frame with the columns of by and n, sum_err, sum_abs_err, sum_sq_err
+        """
+        err = errors['err']
+        return (errors[by].assign(n=1, sum_err=err, sum_abs_err=err.abs(), sum_sq_err=err * err)
+                .groupby(by, observed=True)[_SUMS].sum()
+                .reset_index())
+
+    def _write(self, skill: pd.DataFrame, daily: pd.DataFrame, last_ts: pd.Timestamp) -> None:
+        cur = self._con.cursor()
+        for table, keys, sums, df in (('forecast_skill', list(_GROUPS), _SUMS, skill),
+                                      ('forecast_skill_daily', _DAILY, _SUMS + ['hours'], daily)):
+            if df.empty:
+                continue
+            columns = keys + sums
+            cur.executemany(f"""INSERT INTO wetter.{table} ({', '.join(columns)})
+                                VALUES ({', '.join('?' * len(columns))})
+                                ON DUPLICATE KEY UPDATE {', '.join(f'{c} = {c} + VALUES({c})' for c in sums)}""",
+                            list(df[columns].astype(object).itertuples(index=False, name=None)))
+        cur.execute("""INSERT INTO wetter.verification_state (name, last_ts) VALUES (?, ?)
+                       ON DUPLICATE KEY UPDATE last_ts = VALUES(last_ts)""",
+                    (self.STATE, last_ts.to_pydatetime()))
+
+    @timed('verification')
+    def run(self, now: pd.Timestamp = None) -> int:
+        """
+        Verifies all hours since the last run which are at least delay_h old.
+
+        :param now: current time (UTC, naive), for tests
+        :return: number of forecast/observation pairs added
+        """
+        start_run = perf_counter()
+        schema.migrate(self._con)
+        now = now if now is not None else pd.Timestamp.now(tz='UTC').tz_localize(None)
+        end = (now - self._delay).floor('h')
+        start = self._last_ts()
+        if start is None:
+            start = end - self._backfill
+        added = 0
+        while start < end:
+            chunk_end = min(start + self._chunk, end)
+            fc = self.forecasts(start, chunk_end)
+            skill = daily = pd.DataFrame()
+            errors = self.errors(fc, self.observations(start, chunk_end)) if not fc.empty else pd.DataFrame()
+            if not errors.empty:
+                skill = self.sums(errors, list(_GROUPS))
+                errors = errors.assign(day=errors['ts'].dt.date)
+                # distinct verified hours, each hour is verified in exactly one chunk, so the counts add up
+                hours = errors.groupby(_DAILY, observed=True)['ts'].nunique().rename('hours').reset_index()
+                daily = self.sums(errors, _DAILY).merge(hours, on=_DAILY)
+            try:
+                self._write(skill, daily, chunk_end)
+                self._con.commit()
+            except mariadb.Error as e:
+                logging.error(f'Error when writing forecast skill up to {chunk_end}: {e}')
+                self._con.rollback()
+                break
+            added += len(errors)
+            start = chunk_end
+        inc('verification_pairs', added)
+        logging.info(f'verified {added} forecast/observation pairs up to {start} in {perf_counter() - start_run:.3f}s')
+        return added
+
+
+def load_skill(con: 'mariadb.connection', by: tuple = ('station_id', 'variable'), max_lead_h: int = None) \
+        -> pd.DataFrame:
+    """
+    Reads the accumulated forecast skill.
+
+    :param con: Maria DB connection
+    :param by: grouping, any of station_id, variable, lead_h, issue_hour
+    :param max_lead_h: only lead times up to this many hours
+    :return: frame with the columns of by and n, bias, mae, rmse (forecast - observed)
+    """
+    unknown = set(by) - set(_GROUPS)
+    if unknown:
+        raise ValueError(f'cannot group by {", ".join(unknown)}')
+    columns = ', '.join(by)
+    sums = pd.read_sql(con=con,
+                       sql=f"""SELECT {columns}, {', '.join(f'SUM({c}) AS {c}' for c in _SUMS)}
+                               FROM wetter.forecast_skill
+                               {'WHERE lead_h <= ?' if max_lead_h is not None else ''}
+                               GROUP BY {columns} ORDER BY {columns}""",
+                       params=() if max_lead_h is None else (max_lead_h,))
+    n = sums['n'].astype(float)
+    return sums[list(by)].assign(n=sums['n'],
+                                 bias=sums['sum_err'] / n,
+                                 mae=sums['sum_abs_err'] / n,
+                                 rmse=np.sqrt(sums['sum_sq_err'] / n))
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import os
+import gzip
+import json
+import math
+import hashlib
+import logging
+
+from src.lazy import lazy_import
+
+pd = lazy_import('pandas')
+
+# page rendering the payload in the browser, installed next to it
+PAGE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'wetter.html')
+
+
+def _value(val, digits: int):
+    if val is None or (isinstance(val, float) and math.isnan(val)) or val is pd.NA:
+        return None
+    if isinstance(val, pd.Timestamp):
+        return val.isoformat()
+    return round(float(val), digits)
+
+
+def columns(df: pd.DataFrame, names: list, utc: bool, digits: int = 2) -> dict:
+    """
+    Converts a frame indexed by timestamps into compact columns for the payload.
+
+    :param df: frame with a DatetimeIndex
+    :param names: columns to be exported
+    :param utc: True if the (naive) timestamps are UTC, False for local time
+    :param digits: decimals kept
+    :return: dict 't' -> list of ISO timestamps, name -> list of values (None for missing values)
+    """
+    return {'t': timestamps(df.index, utc),
+            **{name: [_value(val, digits) for val in df[name].tolist()] for name in names}}
+
+
+def timestamps(index, utc: bool) -> list:
+    """
+    :return: ISO strings which the browser reads as UTC (suffix Z) or as its local time
+    """
+    return list(pd.DatetimeIndex(index).strftime('%Y-%m-%dT%H:%M:%SZ' if utc else '%Y-%m-%dT%H:%M:%S'))
+
+
+def write_payload(payload: dict, path: str) -> bool:
+    """
+    Writes the payload as gzip compressed JSON, only if its content hash differs from the one of the last write
+    (kept in <path>.sha256). The file is replaced atomically, its gzip header carries no timestamp.
+
+    :param payload: JSON serializable data
+    :param path: target file, e.g. /var/www/html/wetter/wetter.json.gz
+    :return: True if the file was (re)written
+    """
+    body = json.dumps(payload, separators=(',', ':'), sort_keys=True, allow_nan=False).encode()
+    digest = hashlib.sha256(body).hexdigest()
+    try:
+        with open(path + '.sha256') as f:
+            if f.read().strip() == digest and os.path.exists(path):
+                logging.info(f'{path} unchanged')
+                return False
+    except OSError:
+        pass
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(gzip.compress(body, compresslevel=9, mtime=0))
+    os.replace(path + '.tmp', path)
+    with open(path + '.sha256', 'w') as f:
+        f.write(digest + '\n')
+    logging.info(f'{path} written ({len(body)} bytes json, {os.path.getsize(path)} bytes gzip)')
+    return True
+
+
+def install_page(directory: str, name: str = 'index.html') -> bool:
+    """
+    Copies the static page into directory unless an identical copy is there already.
+
+    :param directory: web directory of the payload
+    :param name: file name of the page
+    :return: True if the page was (re)written
+    """
+    with open(PAGE_PATH, 'rb') as f:
+        page = f.read()
+    path = os.path.join(directory, name)
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == page:
+                return False
+    except OSError:
+        pass
+    os.makedirs(directory, exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(page)
+    os.replace(path + '.tmp', path)
+    logging.info(f'page installed at {path}')
+    return True
@@ -1,31 +1,53 @@
 #!/usr/bin/env python3
 
 import sys
-# import datetime
-from time import sleep
+import signal
+import argparse
+from datetime import datetime
+from time import sleep, monotonic
 import logging
 import mariadb
 from typing import Callable
+from concurrent.futures import ThreadPoolExecutor
 
 import board
 import busio
 import adafruit_bmp280
 import RPi.GPIO as GPIO
 
+from src.measurement_buffer import MeasurementBuffer
+from src.sampling import retry, robust_median
+from src.metrics import METRICS, timed, inc, profiled
+
+import config as cfg
 import public_passwords as pw
 
 
-def get_value_repeatedly(func: Callable = lambda x: None, iterations: int = 5, **kwargs):
+# BMP280 settings of config.py -> register values of adafruit_bmp280
+_OVERSCAN = {1: adafruit_bmp280.OVERSCAN_X1, 2: adafruit_bmp280.OVERSCAN_X2, 4: adafruit_bmp280.OVERSCAN_X4,
+             8: adafruit_bmp280.OVERSCAN_X8, 16: adafruit_bmp280.OVERSCAN_X16}
+_IIR_FILTER = {0: adafruit_bmp280.IIR_FILTER_DISABLE, 2: adafruit_bmp280.IIR_FILTER_X2,
+               4: adafruit_bmp280.IIR_FILTER_X4, 8: adafruit_bmp280.IIR_FILTER_X8,
+               16: adafruit_bmp280.IIR_FILTER_X16}
+_STANDBY = {0.5: adafruit_bmp280.STANDBY_TC_0_5, 62.5: adafruit_bmp280.STANDBY_TC_62_5,
+            125: adafruit_bmp280.STANDBY_TC_125, 250: adafruit_bmp280.STANDBY_TC_250,
+            500: adafruit_bmp280.STANDBY_TC_500, 1000: adafruit_bmp280.STANDBY_TC_1000,
+            2000: adafruit_bmp280.STANDBY_TC_2000, 4000: adafruit_bmp280.STANDBY_TC_4000}
+# deviations from the burst median which are never outliers: 10 resolution steps of the BMP280 (0.01 °C, 0.0016 hPa)
+_MIN_DEVIATION_T = 0.1
+_MIN_DEVIATION_P = 0.016
+
+
+def get_value_repeatedly(func: Callable = lambda x: None, iterations: int = 5,
+                         deadline_s: float = cfg.SENSOR_RETRY_DEADLINE_S, **kwargs):
     """
-    Sensors are stuck sometimes, so it helps to repeatedly try to read a proper value
+    Sensors are stuck sometimes, so it helps to repeatedly try to read a proper value. The waits between the tries
+    grow exponentially, starting short, and no try is started after deadline_s.
     """
-    c = 0
-    val = func(**kwargs)
-    while (c < iterations) & (val is None):
-        val = func(**kwargs)
-        c += 1
-        sleep(1)
+    val, c = retry(func, tries=iterations, deadline_s=deadline_s, **kwargs)
+    inc('sensor_retries', c)
     if val is None:
+        inc('sensor_read_failures')
         logging.warning('could not read value')
     return val
 
@@ -45,57 +67,150 @@ def read_light(pin_in: int = 24) -> int:
     return light
 
 
-def read_bmp280_vals(address: int = 0x76) -> (float, float):
+def setup_bmp280(address: int = 0x76) -> adafruit_bmp280.Adafruit_BMP280_I2C:
     """
-    Get temperature and pressure from BMP280.
+    Connects the BMP280 and applies oversampling, IIR filter and mode from config.py.
     :param address: specify I2C address
-    :return: tuple (temperature, pressure)
+    :return: sensor
     """
-    # setup BMP280 / I2C
-    i2c = busio.I2C(board.SCL, board.SDA)
-    bmp280 = adafruit_bmp280.Adafruit_BMP280_I2C(i2c, address=address)
+    bmp280 = adafruit_bmp280.Adafruit_BMP280_I2C(busio.I2C(board.SCL, board.SDA), address=address)
     bmp280.sea_level_pressure = 1025.25
-    bmp280._mode = adafruit_bmp280.MODE_SLEEP
-    bmp280._t_standby = adafruit_bmp280.STANDBY_TC_1000
+    bmp280.overscan_temperature = _OVERSCAN[cfg.BMP280_OVERSAMPLING_T]
+    bmp280.overscan_pressure = _OVERSCAN[cfg.BMP280_OVERSAMPLING_P]
+    bmp280.iir_filter = _IIR_FILTER[cfg.BMP280_IIR_FILTER]
+    bmp280.standby_period = _STANDBY[cfg.BMP280_STANDBY_MS]
+    # in sleep mode every read triggers one forced conversion, in normal mode the sensor converts continuously
+    bmp280.mode = adafruit_bmp280.MODE_NORMAL if cfg.BMP280_MODE == 'normal' else adafruit_bmp280.MODE_SLEEP
+    return bmp280
 
-    temperature = bmp280.temperature
-    pressure = bmp280.pressure
-    bmp280._mode = adafruit_bmp280.MODE_SLEEP
-    del bmp280
 
+def _conversion_period_s() -> float:
+    """
+    :return: seconds until a BMP280 in normal mode has a new conversion (maximum measurement time of the datasheet
+        plus standby)
+    """
+    measurement_ms = 1.25 + 2.3 * cfg.BMP280_OVERSAMPLING_T + 2.3 * cfg.BMP280_OVERSAMPLING_P + .575
+    return (measurement_ms + cfg.BMP280_STANDBY_MS) / 1000
+
+
+@timed('bmp280_read')
+def read_bmp280_burst(bmp280: adafruit_bmp280.Adafruit_BMP280_I2C, n: int = cfg.SENSOR_BURST) -> (float, float):
+    """
+    Reads n samples from the BMP280 and combines temperature and pressure to their medians without outliers.
+    :param bmp280: sensor set up by setup_bmp280
+    :param n: number of samples
+    :return: tuple (temperature, pressure)
+    """
+    temperatures, pressures = [], []
+    error = None
+    for i in range(n):
+        if i and cfg.BMP280_MODE == 'normal':
+            sleep(_conversion_period_s())  # wait for a new conversion instead of reading the same one again
+        try:
+            temperatures.append(bmp280.temperature)
+            pressures.append(bmp280.pressure)
+        except (ValueError, OSError) as e:
+            error = e
+    if not temperatures:
+        raise error
+    temperature, rejected_t = robust_median(temperatures, min_deviation=_MIN_DEVIATION_T)
+    pressure, rejected_p = robust_median(pressures, min_deviation=_MIN_DEVIATION_P)
+    inc('sensor_outliers', rejected_t + rejected_p)
     return temperature, pressure
 
 
+def read_bmp280_vals(address: int = 0x76) -> (float, float):
+    """
+    Get temperature and pressure from BMP280.
+    :param address: specify I2C address
+    :return: tuple (temperature, pressure)
+    """
+    bmp280 = setup_bmp280(address)
+    try:
+        return read_bmp280_burst(bmp280)
+    finally:
+        bmp280.mode = adafruit_bmp280.MODE_SLEEP
+
+
 def read_weather() -> (bool, float, float):
     """
-    Returns the light, temperature and pressure sensor results
+    Returns the light, temperature and pressure sensor results, the light sensor is read (and retried) while the
+    BMP280 is sampled.
     :return: triple (light, temperature, pressure)
     """
-    light = get_value_repeatedly(read_light)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        light_future = executor.submit(get_value_repeatedly, read_light)
+        temp_to_db = None
+        press_to_db = None
+        try:
+            temp_to_db, press_to_db = read_bmp280_vals()
+        except (ValueError, OSError) as e:
+            logging.error(f'Could not read values from BMP280. Check connection - {e}')
+        light = light_future.result()
+
     hell = None
     try:
         hell = not bool(light)  # light is actually 1 if it is dark...
     except TypeError as e:
         logging.error(f'Light sensor does not give a proper output! {e}')
 
-    temp_to_db = None
-    press_to_db = None
-    try:
-        temp_to_db, press_to_db = read_bmp280_vals()
-    except (ValueError, OSError) as e:
-        logging.error(f'Could not read values from BMP280. Check connection - {e}')
-
     return hell, temp_to_db, press_to_db
 
 
-def round_or_null(val, n=2) -> [str, float]:
+class Sensors:
+    """
+    Light sensor and BMP280 which are set up once and can then be read repeatedly (used by the daemon mode).
+    """
+    def __init__(self, pin_in: int = 24, address: int = 0x76):
+        """
+        Initialize GPIO and I2C.
+        :param pin_in: GPIO pin of the light sensor
+        :param address: I2C address of the BMP280
+        """
+        self._pin_in = pin_in
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(pin_in, GPIO.IN)
+        self._bmp280 = setup_bmp280(address)
+        self._light_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='light')
+
+    def _read_light(self) -> int:
+        return GPIO.input(self._pin_in)
+
+    def read(self) -> (bool, float, float):
+        """
+        Returns the light, temperature and pressure sensor results, light and BMP280 are read concurrently
+        :return: triple (light, temperature, pressure)
+        """
+        light_future = self._light_executor.submit(get_value_repeatedly, self._read_light)
+
+        temperature = None
+        pressure = None
+        try:
+            temperature, pressure = read_bmp280_burst(self._bmp280)
+        except (ValueError, OSError) as e:
+            logging.error(f'Could not read values from BMP280. Check connection - {e}')
+
+        light = light_future.result()
+        hell = None if light is None else not bool(light)  # light is actually 1 if it is dark...
+        return hell, temperature, pressure
+
+    def close(self) -> None:
+        self._light_executor.shutdown()
+        try:
+            self._bmp280.mode = adafruit_bmp280.MODE_SLEEP
+        except (ValueError, OSError) as e:
+            logging.warning(f'Could not put BMP280 to sleep - {e}')
+        GPIO.cleanup()
+
+
+def round_or_null(val, n=2) -> [None, float]:
     """
-    Will round val to n digits precision. If val is None or fails to be rounded the function returns 'NULL'
+    Will round val to n digits precision. If val is None or fails to be rounded the function returns None
     :param val: value to be rounded
     :param n: no of digits after the comma (precision)
-    :return: rounded value or, if not possible, string 'NULL'
+    :return: rounded value or, if not possible, None (stored as NULL)
     """
-    res = 'NULL'
+    res = None
     if val is None:
         return res
     try:
@@ -105,52 +220,94 @@ def round_or_null(val, n=2) -> [str, float]:
     return res
 
 
-def write_into_db(con_: 'mariadb.connection', hell: bool, temperature: float, pressure: float) -> None:
+def store_sample(buffer: MeasurementBuffer, hell: bool, temperature: float, pressure: float) -> None:
     """
-    Writes values into MariaDB
-    :param con_: DB connection
+    Writes one sample with the current timestamp into the local buffer
+    :param buffer: local measurement buffer
     :param hell: light intensity (boolean)
     :param temperature: measured temperature
     :param pressure: measured air pressure
     :return: None
     """
-    # connected:
-    cur = con_.cursor()
-    logging.info(f'Connected to DB - Now storing values {hell}, {temperature}, {pressure} in DB:')
-    try:
-        cur.execute(
-            f"""INSERT INTO messung (zeit, temperature, pressure, hell) 
-                VALUES (CURRENT_TIMESTAMP,
-                        {round_or_null(temperature, 2)},
-                        {round_or_null(pressure, 2)},
-                        {round_or_null(hell)})
-            """)
-    except mariadb.Error as e:
-        logging.error(f'Error when inserting new measurements: {e}')
-        pass
-
-    con_.commit()
-    logging.info(f'Done. Last Inserted ID: {cur.lastrowid}')
-    con_.close()
+    zeit = datetime.now().replace(microsecond=0)
+    logging.debug(f'storing values {zeit}, {hell}, {temperature}, {pressure} in buffer')
+    buffer.append(zeit, hell, round_or_null(temperature, 2), round_or_null(pressure, 2))
     return
 
 
+def connect() -> 'mariadb.connection':
+    con_ = mariadb.connect(
+        database='wetter',
+        **pw.mariadb_cred
+    )
+    logging.info('connected to MariaDB - wetter')
+    return con_
+
+
+def run_daemon(buffer: MeasurementBuffer, sensors: Sensors, interval: float, batch_size: int) -> None:
+    """
+    Samples the sensors every interval seconds into the buffer and flushes the buffer to MariaDB whenever
+    batch_size samples are pending, until the process is stopped. If the DB is not reachable the samples stay
+    in the buffer and are flushed with the next batch.
+    :param buffer: local measurement buffer
+    :param sensors: initialized sensors
+    :param interval: seconds between two samples
+    :param batch_size: number of pending samples which trigger a flush
+    :return: None
+    """
+    logging.info(f'Daemon started, sampling every {interval}s, writing batches of {batch_size}')
+    con_ = None
+    next_sample = monotonic()
+    try:
+        while True:
+            store_sample(buffer, *sensors.read())
+            if buffer.pending() >= batch_size:
+                try:
+                    con_ = con_ or connect()
+                    buffer.flush_all(con_)
+                except mariadb.Error as e:
+                    logging.error(f'Could not flush measurements, keeping {buffer.pending()} in buffer: {e}')
+                    if con_ is not None:
+                        con_.close()
+                    con_ = None
+                METRICS.write_textfile(cfg.METRICS_DIR, 'temperature_pressure_db')
+            next_sample += interval
+            sleep(max(0., next_sample - monotonic()))
+    finally:
+        sensors.close()
+        if con_ is not None:
+            con_.close()
+        buffer.close()
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Reads light, temperature and pressure and stores them in the DB.')
+    parser.add_argument('--daemon', action='store_true', help='keep running and sample periodically')
+    parser.add_argument('--interval', type=float, default=cfg.SENSOR_INTERVAL_S, help='seconds between samples')
+    parser.add_argument('--batch', type=int, default=cfg.SENSOR_BATCH_SIZE, help='samples per DB transaction')
+    args = parser.parse_args()
+
     logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
                         filename='/home/pi/logs/db_mess_wetter.log',
                         level=logging.INFO)
+    measurement_buffer = MeasurementBuffer(cfg.MEASUREMENT_BUFFER_PATH)
+    if args.daemon:
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        run_daemon(measurement_buffer, Sensors(), args.interval, args.batch)
+        sys.exit(0)
+
     logging.info('Script started, reading values')
-    sensor_values = read_weather()
-    logging.info('connecting to DB')
     try:
-        con = mariadb.connect(
-            database='wetter',
-            **pw.mariadb_cred
-        )
-    except mariadb.Error as e:
-        logging.error(f'Error connecting to MariaDB Platform: {e}')
-        sys.exit(1)
-    logging.info('connected to MariaDB - wetter')
-
-    write_into_db(con, *sensor_values)
+        with profiled('temperature_pressure_db', cfg.PROFILE_DIR):
+            store_sample(measurement_buffer, *read_weather())
+            logging.info('connecting to DB')
+            try:
+                con = connect()
+                measurement_buffer.flush_all(con)
+            except mariadb.Error as e:
+                logging.error(f'Error writing to MariaDB, {measurement_buffer.pending()} samples kept in buffer: {e}')
+                sys.exit(1)
+            con.close()
+    finally:
+        METRICS.write_textfile(cfg.METRICS_DIR, 'temperature_pressure_db')
     logging.info('Script finished successfully')
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+import sys
+import mariadb
+import logging
+
+from src.verification import Verifier, load_skill
+from src.metrics import METRICS, profiled
+
+import config as cfg
+import public_passwords as pw
+
+
+def run(con: 'mariadb.connection') -> bool:
+    """
+    Verifies the forecasts of all hours since the last run against the measurements.
+    :param con: DB connection
+    :return: True if forecast/observation pairs were added
+    """
+    verifier = Verifier(con, cfg.DWD_STATION_IDS, local_tz=cfg.LOCAL_TZ, delay_h=cfg.VERIFY_DELAY_H,
+                        backfill_days=cfg.VERIFY_BACKFILL_DAYS)
+    return verifier.run() > 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        filename='/home/pi/logs/verify_wetter.log',
+                        level=logging.INFO)
+    logging.info(' *  Script started - connecting to DB')
+    try:
+        con = mariadb.connect(
+            database='wetter',
+            **pw.mariadb_cred
+        )
+    except mariadb.Error as e:
+        logging.error(f'Error connecting to MariaDB Platform: {e}')
+        sys.exit(1)
+    logging.info('connected to MariaDB - wetter')
+
+    with profiled('verify_forecast', cfg.PROFILE_DIR):
+        run(con)
+        for row in load_skill(con, max_lead_h=48).itertuples(index=False):
+            logging.info(f'skill up to 48 h: {row.station_id} {row.variable}: n={row.n} bias={row.bias:.2f} '
+                         f'mae={row.mae:.2f} rmse={row.rmse:.2f}')
+    METRICS.write_textfile(cfg.METRICS_DIR, 'verify_forecast')
+
+    con.close()
+    logging.info('done')
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import sys
+import signal
+import argparse
+import logging
+import mariadb
+
+from src.api import QueryApi, ResponseCache
+from src import schema
+
+import config as cfg
+import public_passwords as pw
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serves measurements and forecasts of the DB as JSON or CSV.')
+    parser.add_argument('--host', default=cfg.API_HTTP[0], help='address to listen on')
+    parser.add_argument('--port', type=int, default=cfg.API_HTTP[1], help='port to listen on')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(threadName)s - %(levelname)s - %(message)s',
+                        filename='/home/pi/logs/weather_api.log',
+                        level=logging.INFO)
+    logging.info(' *  API started - creating connection pool')
+    try:
+        db_pool = mariadb.ConnectionPool(pool_name='wetter_api', pool_size=cfg.API_POOL_SIZE, database='wetter',
+                                         **pw.mariadb_cred)
+        con = db_pool.get_connection()
+        schema.migrate(con)
+        con.close()
+    except mariadb.Error as e:
+        logging.error(f'Error connecting to MariaDB Platform: {e}')
+        sys.exit(1)
+
+    api = QueryApi(db_pool, ResponseCache(cfg.API_CACHE_ENTRIES, cfg.API_CACHE_TTL_S),
+                   station_ids=cfg.DWD_STATION_IDS, retention_days=cfg.TIER_RETENTION_DAYS, max_rows=cfg.API_MAX_ROWS)
+    server = api.make_server((args.host, args.port))
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    logging.info(f'serving on {args.host or "*"}:{server.server_address[1]}')
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -1,45 +1,194 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
+import os
 import sys
+import argparse
 # from time import sleep
+from time import time
 import logging
-import pandas as pd
-import matplotlib.pyplot as plt
+from datetime import datetime, timedelta
+from functools import cached_property
+from concurrent.futures import ProcessPoolExecutor
 # import matplotlib.ticker as ticker
 import mariadb
 
+from src.lazy import lazy_import
+from src.metrics import METRICS, timed, profiled
+from src.rollup import Rollup, select_tier
+from src import schema
+from src.dtypes import FORECAST, compact
+from src.blend import ww_mode, load_blend
+from src import web_export
+
+import config as cfg
 import public_passwords as pw
 
+# loaded on first use, i.e. only after the DB connection is established
+pd = lazy_import('pandas')
+matplotlib = lazy_import('matplotlib')
+
 
+@timed('graph_load_data')
 def load_data(con_: 'mariadb.connection') -> (pd.DataFrame, pd.DataFrame, pd.DataFrame):
     """
     Loads dataframes from db
     :param con_: connection to MariaDB - Wetter
-    :return: triple of dataframes: measured data of the last 3 days, actual forecast and significant weather codes.
+    :return: triple of dataframes: aggregated measurements of the last 3 days (coarsest tier up to 30 min),
+     actual forecast (the blend of all stations, the raw rows of the stations if nothing is blended yet) and
+     significant weather codes.
     """
     logging.info('load from db: ')
-    df = pd.read_sql(con=con_, sql=f"""
-        SELECT * FROM wetter.messung WHERE zeit >= (TIMESTAMP(sysdate())- INTERVAL 3 day);
-        """).set_index('id')
-
-    df_raw = pd.read_sql(con=con_, sql=f"""
-        select
-            id, ts, station_id, last_update,
-            temperatur, druck, sonnenscheinminuten, wind_max_1h, wind, niederschlag_1h, p_regen, ww
-        from wetter.forecast_dwd
-        where ts >= TIMESTAMP(sysdate())""").set_index('id')
-
-    df_ww = pd.read_sql(con=con_, sql=f"""select * from wetter.ww_codes """).set_index('id')
-    return df, df_raw, df_ww
-
-
-def preprocess_graph(df_mess_, df_fc_raw_, df_ww_codes_) -> \
+    schema.migrate(con_)
+    now = datetime.now()
+    since = now - timedelta(days=3)
+    rollup = Rollup(con_, *select_tier(since, '30min', cfg.TIER_RETENTION_DAYS))
+    rollup.refresh()
+    df = rollup.load(since=since)
+
+    with timed('graph_read_forecast'):
+        df_blend = load_blend(con_, now)
+        if not df_blend.empty:
+            return df, df_blend, load_ww_codes(con_)
+        # range scans on the keys (station_id, ts) and (station_id, issue_time) of the configured stations only;
+        # forecast_dwd.last_update is the issue which last changed a row, the latest issue is kept per station
+        stations = ', '.join('?' * len(cfg.DWD_STATION_IDS))
+        df_raw = pd.read_sql(con=con_, sql=f"""
+            select
+                f.id, f.ts, f.station_id, coalesce(i.issue_time, f.last_update) as last_update,
+                f.temperatur, f.druck, f.sonnenscheinminuten, f.wind_max_1h, f.wind, f.niederschlag_1h, f.p_regen, f.ww
+            from wetter.forecast_dwd f
+            left join (select station_id, max(issue_time) as issue_time
+                       from wetter.forecast_dwd_issue
+                       where station_id in ({stations})
+                       group by station_id) i on i.station_id = f.station_id
+            where f.station_id in ({stations}) and f.ts >= ?""",
+                             params=(*cfg.DWD_STATION_IDS, *cfg.DWD_STATION_IDS, now), index_col='id')
+        df_raw = compact(df_raw, FORECAST)
+
+    return df, df_raw, load_ww_codes(con_)
+
+
+# (time loaded, frame) of wetter.ww_codes, shared by the runs of a long running process
+_WW_CODES = None
+
+
+def load_ww_codes(con_: 'mariadb.connection', path: str = cfg.WW_CODES_CACHE_PATH,
+                  max_age_s: float = cfg.WW_CODES_MAX_AGE_S) -> pd.DataFrame:
+    """
+    Returns the (static) significant weather codes from the process cache, a csv copy on disk or the DB, in this
+    order. Both caches are renewed from the DB once they are older than max_age_s.
+    :param con_: connection to MariaDB - Wetter
+    :param path: csv copy of wetter.ww_codes, None to skip the disk cache
+    :param max_age_s: seconds after which the codes are loaded again
+    :return: dataframe of ww codes indexed by id
+    """
+    global _WW_CODES
+    if _WW_CODES is not None and time() - _WW_CODES[0] < max_age_s:
+        return _WW_CODES[1]
+    try:
+        if path is not None and os.path.exists(path) and time() - os.path.getmtime(path) < max_age_s:
+            _WW_CODES = (os.path.getmtime(path), pd.read_csv(path, index_col='id'))
+            return _WW_CODES[1]
+    except (OSError, ValueError) as e:
+        logging.warning(f'ww codes cache {path} not readable: {e}')
+
+    df_ww = pd.read_sql(con=con_, sql='select * from wetter.ww_codes', index_col='id')
+    if path is not None:
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            df_ww.to_csv(path + '.tmp')
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            logging.warning(f'could not write ww codes cache {path}: {e}')
+    _WW_CODES = (time(), df_ww)
+    return df_ww
+
+
+class ForecastData:
+    """
+    Forecast preparation shared by all plots: the mean over all stations and the ww mode per timestamp are
+    computed once (or taken as they are from a blended forecast), the plots get (memoized) time windows of them.
+    Timestamps are kept naive, bounds given in another time zone are converted once instead of localizing the
+    whole ts column for every comparison.
+    """
+    def __init__(self, df_fc_raw_: pd.DataFrame, df_ww_codes_: pd.DataFrame):
+        """
+        :param df_fc_raw_: raw forecast rows of all stations or the blended forecast (as returned by load_data)
+        :param df_ww_codes_: significant weather codes indexed by id
+        """
+        self._raw = df_fc_raw_.sort_values('ts')
+        self._ww_codes = df_ww_codes_
+        self._significant_weather = {}
+
+    @property
+    def raw(self):
+        return self._raw
+
+    @cached_property
+    def mean(self) -> pd.DataFrame:
+        """
+        :return: mean of all numeric forecast values over the stations, indexed by ts
+        """
+        if 'station_id' not in self._raw.columns:  # blended already, one row per ts
+            return self._raw.set_index('ts').select_dtypes('number')
+        return self._raw.groupby('ts').mean(numeric_only=True)
+
+    @cached_property
+    def ww(self) -> pd.Series:
+        """
+        :return: ww mode over the stations, indexed by ts
+        """
+        if 'station_id' not in self._raw.columns:
+            return self._raw.set_index('ts')['ww'].dropna().astype('int64')
+        return ww_mode(self._raw['ts'], self._raw['ww'])
+
+    @staticmethod
+    def _naive(ts: pd.Timestamp) -> pd.Timestamp:
+        return ts.tz_localize(None) if ts is not None and ts.tzinfo is not None else ts
+
+    def window(self, start: pd.Timestamp, end: pd.Timestamp = None) -> (pd.DataFrame, pd.DataFrame):
+        """
+        :param start: first timestamp (aware timestamps are taken as wall time of their zone)
+        :param end: last timestamp (inclusive), None for open end
+        :return: tuple (raw rows, station mean) within the window
+        """
+        start, end = self._naive(start), self._naive(end)
+        ts = self._raw['ts']
+        raw_mask = (ts >= start) if end is None else (ts >= start) & (ts <= end)
+        return self._raw.loc[raw_mask], self.mean.loc[start:end]
+
+    def significant_weather(self, start: pd.Timestamp, end: pd.Timestamp = None, freq: str = '2h') -> pd.DataFrame:
+        """
+        :param start: first timestamp (aware timestamps are taken as wall time of their zone)
+        :param end: last timestamp (inclusive), None for open end
+        :param freq: bucket size
+        :return: dataframe with bucket ts, dominant ww code and its description
+        """
+        # all plots share the hourly ww series, the memo only saves the bucketing when the same window is prepared
+        # again (preprocess_fc for the image and the web export). Keyed by the positions of the window in the series,
+        # as the bounds are based on now and differ between the two calls
+        index = self.ww.index
+        start, end = self._naive(start), self._naive(end)
+        key = (index.searchsorted(start, 'left'), len(index) if end is None else index.searchsorted(end, 'right'),
+               freq)
+        if key not in self._significant_weather:
+            ww_ts = self.ww.iloc[key[0]:key[1]]
+            self._significant_weather[key] = (ww_mode(ww_ts.index.floor(freq).to_series(), ww_ts)
+                                              .rename_axis('ts')
+                                              .reset_index()
+                                              .merge(self._ww_codes, left_on='ww', right_on='id')
+                                              )
+        return self._significant_weather[key]
+
+
+def preprocess_graph(df_mess_: pd.DataFrame, fc_data: ForecastData) -> \
         (pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame, (float, float), (float, float)):
     """
     draws graph and saves it at path
-    :param df_mess_: raw data with temperature, zeit, pressure, hell7
-    :param df_fc_raw_: pd.DataFrame with forecast values
-    :param df_ww_codes_: pd.DataFrame with forecast texts
+    :param df_mess_: (30-min aggregated) data with temperature, zeit, pressure, hell
+    :param fc_data: prepared forecast
     :return: 4 dataframes (30-min aggregated measures, mean forecast, light on_off timestamps,
      significant weather forecast)
     and two tuples with the y-axis limits for the temperature and pressure
@@ -62,41 +211,47 @@ def preprocess_graph(df_mess_, df_fc_raw_, df_ww_codes_) -> \
 
     # Forecast:
     now = pd.Timestamp.now(tz='CET')
-    fc = df_fc_raw_.loc[(df_fc_raw_['ts'].dt.tz_localize('CET') >= now)
-                        & (df_fc_raw_['ts'].dt.tz_localize('CET') <= now + pd.DateOffset(hours=36))].copy()
-    mittel = fc.groupby('ts').mean()
-
-    wetter = (fc.groupby('ts')
-              [['ww']]
-              .agg(lambda x: x.value_counts().index[0])
-              .resample('2h')
-              .agg(lambda x: x.value_counts().index[0])
-              .reset_index()
-              .merge(df_ww_codes_, left_on='ww', right_on='id')  # .set_index('ts')
-              )
+    _, mittel = fc_data.window(now, now + pd.DateOffset(hours=36))
+    wetter = fc_data.significant_weather(now, now + pd.DateOffset(hours=36), '2h')
     return df_agg, mittel, on_off, wetter, lims_t, lims_p
 
 
+def _figure(fig: Figure = None) -> Figure:
+    """
+    Returns an empty 12x8 figure, either a new one or the given one cleared for reuse.
+    Figures are created without pyplot, so no global state keeps them alive after they are dropped.
+    """
+    if fig is None:
+        matplotlib.use('Agg')
+        from matplotlib.figure import Figure
+        return Figure(figsize=(12, 8))
+    fig.clear()
+    return fig
+
+
+@timed('draw_graph')
 def draw_graph(df_mess_: pd.DataFrame,
-               df_fc_raw_: pd.DataFrame,
-               df_ww_codes_: pd.DataFrame,
+               fc_data: ForecastData,
                path: str = '/var/www/html/img/wetter3.jpg',
-               show_on_off: bool = False) -> 'matplotlib.pyplot':
+               show_on_off: bool = False,
+               fig: Figure = None) -> Figure:
     """
     draws graph and saves it at path
     :param df_mess_: raw data with temperature, zeit, pressure, hell
-    :param df_fc_raw_: pd.DataFrame with forecast values
-    :param df_ww_codes_: pd.DataFrame with forecast descriptions
+    :param fc_data: prepared forecast
     :param path: path where final plot is saved to
     :param show_on_off: flags if light changes shoud be shown
-    :return: plot with measured values and forecast
+    :param fig: figure to be reused (cleared first), a new one is created if None
+    :return: figure with measured values and forecast
     """
-    df_agg, mittel, on_off, wetter, lims_t, lims_p = preprocess_graph(df_mess_, df_fc_raw_, df_ww_codes_)
+    df_agg, mittel, on_off, wetter, lims_t, lims_p = preprocess_graph(df_mess_, fc_data)
 
     # Draw:
+    fig = _figure(fig)
+    ax = fig.subplots()
 
     plot_title = f'Wetterdaten (letzte 3 Tage); erstellt: {pd.Timestamp.now(tz="CET").strftime("%Y-%m-%d %H:%M")}'
-    ax_t = df_agg.temperature.plot(grid=True, secondary_y=True, figsize=(12, 8), style='-', color='red', linewidth=3.5,
+    ax_t = df_agg.temperature.plot(ax=ax, grid=True, secondary_y=True, style='-', color='red', linewidth=3.5,
                                    title=plot_title)
 
     mittel[['temperatur']].resample('h').mean().plot(color='red', ax=ax_t, secondary_y=True, linewidth=3, style='--',
@@ -109,13 +264,13 @@ def draw_graph(df_mess_: pd.DataFrame,
      .mean() * (lims_t[1] - lims_t[0]) / 100 + lims_t[0]) \
         .plot(secondary_y=True, ax=ax_t, linestyle='--', color='deepskyblue', linewidth=3, legend=None)
 
-    bottom, top = plt.ylim()
+    bottom, top = ax_t.get_ylim()
     for i in range(2, len(wetter) - 1):
-        plt.text(wetter.iloc[i, 0], bottom + 1, str(wetter.iloc[i, 1]) + ' - ' + wetter.iloc[i, 2], rotation='vertical',
-                 color='grey', alpha=1)
+        ax_t.text(wetter.iloc[i, 0], bottom + 1, str(wetter.iloc[i, 1]) + ' - ' + wetter.iloc[i, 2],
+                  rotation='vertical', color='grey', alpha=1)
 
-    ax_p = df_agg['hell'].plot(color='yellow', linewidth=0.01)
-    ax_p = df_agg['pressure'].plot(style='-', color='indigo', grid=True, linewidth=3)
+    ax_p = df_agg['hell'].plot(ax=ax, color='yellow', linewidth=0.01)
+    ax_p = df_agg['pressure'].plot(ax=ax, style='-', color='indigo', grid=True, linewidth=3)
     ax_p.set_ylabel('Luftdruck in hPa', color='indigo')
     ax_p.set_ylim(lims_p)
     ax_p.fill_between(x=df_agg.index, y1=df_agg['hell'], facecolor='yellow', alpha=0.3)
@@ -126,7 +281,7 @@ def draw_graph(df_mess_: pd.DataFrame,
 
     if show_on_off:
         for ts in on_off:
-            plt.text(ts, lims_t[0] + 0.5, '* ' + ts.strftime('%H:%M'), rotation='vertical', color='g')
+            ax_t.text(ts, lims_t[0] + 0.5, '* ' + ts.strftime('%H:%M'), rotation='vertical', color='g')
 
     # ax_p.xaxis.set_minor_locator(ticker.NullLocator())
     # positions = pd.date_range(start=pd.to_datetime('now') + pd.DateOffset(hours=-72),
@@ -136,48 +291,41 @@ def draw_graph(df_mess_: pd.DataFrame,
     # ax_p.set_xticklabels(labels, fontsize=8, rotation=60, ha='right')
     # ax_p.set_xlabel('Zeit')
 
-    plt.savefig(path)
-    return plt
+    with timed('savefig'):
+        fig.savefig(path)
+    return fig
 
 
-def preprocess_fc(df_fc_raw_: pd.DataFrame, df_ww_codes_: pd.DataFrame) \
-        -> (pd.DataFrame, pd.DataFrame, pd.DataFrame, 'Timestamp'):
+def preprocess_fc(fc_data: ForecastData) -> (pd.DataFrame, pd.DataFrame, pd.DataFrame, 'Timestamp'):
     """
     Preprocesses raw fc data to be plotted
-    :param df_fc_raw_: raw fc data with temperature, zeit, pressure, hell
-    :param df_ww_codes_: significant weather codes
+    :param fc_data: prepared forecast
     :return: 3 dataframes (latest forecast, aggregated, significant weather descriptions) and latest update timestamp
     """
-    latest_fc = df_fc_raw_.loc[df_fc_raw_.ts >= pd.to_datetime('now')].copy()
-    last_update = latest_fc['last_update'].min()
-
+    now = pd.to_datetime('now')
     # different stations - take mean of scalar values
-    mean_fc = latest_fc.groupby('ts').mean()
+    latest_fc, mean_fc = fc_data.window(now)
+    last_update = latest_fc['last_update'].min()
 
     # significant weather ww - take mode and merge with description
-    significant_weather = (latest_fc.groupby('ts')[['ww']]
-                           .agg(lambda x: x.value_counts().index[0]).
-                           resample('6h')
-                           .agg(lambda x: x.value_counts().index[0])
-                           .reset_index()
-                           .merge(df_ww_codes_, left_on='ww', right_on='id')  # .set_index('ts')
-                           )
+    significant_weather = fc_data.significant_weather(now, freq='6h')
     return latest_fc, mean_fc, significant_weather, last_update
 
 
-def draw_fc(df_fc_raw_: pd.DataFrame, df_ww_codes_: pd.DataFrame,
-            path: str = '/var/www/html/img/fc.jpg') -> 'matplotlib.pyplot':
+@timed('draw_fc')
+def draw_fc(fc_data: ForecastData, path: str = '/var/www/html/img/fc.jpg', fig: Figure = None) -> Figure:
     """
     draws forecast graph and saves it at path
-    :param df_fc_raw_: raw data with temperature, zeit, pressure, hell
-    :param df_ww_codes_: significant weather codes
+    :param fc_data: prepared forecast
     :param path: path
-    :return: plt with two subfigures
+    :param fig: figure to be reused (cleared first), a new one is created if None
+    :return: figure with two subplots
     """
-    latest_fc, mean_fc, significant_weather, last_update = preprocess_fc(df_fc_raw_, df_ww_codes_)
+    latest_fc, mean_fc, significant_weather, last_update = preprocess_fc(fc_data)
 
     # draw plots:
-    f, (ax1, ax2) = plt.subplots(2, 1, sharex=True, figsize=(12, 8))
+    fig = _figure(fig)
+    ax1, ax2 = fig.subplots(2, 1, sharex=True)
     # upper plot:
     mean_fc[['temperatur']].resample('h').mean().plot(color='red', grid=True, ax=ax1, linewidth=3)
     bottom, top = ax1.get_ylim()
@@ -215,25 +363,129 @@ def draw_fc(df_fc_raw_: pd.DataFrame, df_ww_codes_: pd.DataFrame,
     ax2.set_xticks(positions)
     ax2.set_xticklabels(labels, fontsize=8, rotation=60, ha='right')
     ax2.set_xlabel('Datum')
-    bottom, top = plt.ylim()
+    bottom, top = ax2_r.get_ylim()
 
     # ww texts
     for i in range(0, len(significant_weather)):
-        plt.text(significant_weather.iloc[i, 0],
-                 bottom + 1,
-                 f'{significant_weather.iloc[i, 2]}  ({significant_weather.iloc[i, 1]})',
-                 rotation='vertical', color='grey', alpha=0.8)
-        
+        ax2_r.text(significant_weather.iloc[i, 0],
+                   bottom + 1,
+                   f'{significant_weather.iloc[i, 2]}  ({significant_weather.iloc[i, 1]})',
+                   rotation='vertical', color='grey', alpha=0.8)
+
     # day of week texts:
     day_locs = [p for p in positions if (p.hour == 12)]
     weekdays = {6: 'So', 0: 'Mo', 1: 'Di', 2: 'Mi', 3: 'Do', 4: 'Fr', 5: 'Sa'}
     for i, dl in enumerate(day_locs):
-        plt.text(dl, top + 5, weekdays.get(dl.weekday(), ''), size=16, color='black')
-    plt.savefig(path)
-    return plt
+        ax2_r.text(dl, top + 5, weekdays.get(dl.weekday(), ''), size=16, color='black')
+    with timed('savefig'):
+        fig.savefig(path)
+    return fig
+
+
+def _weather_labels(df_ww: pd.DataFrame) -> list:
+    """
+    :param df_ww: significant weather as returned by ForecastData.significant_weather
+    :return: list of [ts (UTC), ww code, description]
+    """
+    return [[t, int(ww), str(text)] for t, ww, text in zip(web_export.timestamps(df_ww.iloc[:, 0], utc=True),
+                                                           df_ww.iloc[:, 1], df_ww.iloc[:, 2])]
+
+
+@timed('export_web')
+def export_web(df_mess_: pd.DataFrame, fc_data: ForecastData, directory: str = '/var/www/html/wetter') -> bool:
+    """
+    Writes the data of both plots as compact gzip JSON (wetter.json.gz) next to a static page which draws the
+    charts in the browser, instead of rendering images on the Pi. The payload is only rewritten if its content
+    changed.
+    :param df_mess_: (30-min aggregated) data with temperature, zeit, pressure, hell
+    :param fc_data: prepared forecast
+    :param directory: web directory
+    :return: True if the payload was rewritten
+    """
+    df_agg, mittel, on_off, wetter, lims_t, lims_p = preprocess_graph(df_mess_, fc_data)
+    latest_fc, mean_fc, significant_weather, last_update = preprocess_fc(fc_data)
+    payload = {
+        'graph': {'measured': web_export.columns(df_agg, ['temperature', 'pressure', 'hell'], utc=False),
+                  'forecast': web_export.columns(mittel[['temperatur', 'p_regen']].resample('h').mean(),
+                                                 ['temperatur', 'p_regen'], utc=True),
+                  'weather': _weather_labels(wetter.iloc[2:-1]),  # the labels shown in draw_graph
+                  'on_off': web_export.timestamps(on_off, utc=False),
+                  'lims_t': [round(float(lim), 2) for lim in lims_t],
+                  'lims_p': [round(float(lim), 2) for lim in lims_p]},
+        'fc': {'values': web_export.columns(mean_fc, ['temperatur', 'sonnenscheinminuten', 'wind_max_1h', 'wind',
+                                                     'niederschlag_1h', 'p_regen'], utc=True),
+               'weather': _weather_labels(significant_weather),
+               'last_update': None if pd.isna(last_update) else f'{last_update:%Y-%m-%dT%H:%M:%S}Z'}}
+    web_export.install_page(directory)
+    return web_export.write_payload(payload, os.path.join(directory, 'wetter.json.gz'))
+
+
+# figures kept for reuse by render_all in long running processes
+_FIGURES = {}
+
+
+def _render(name: str, *args) -> (str, float):
+    """
+    Renders one image in a worker process and frees the figure afterwards.
+    :return: tuple (name of the rendered image, seconds), timings of the worker's registry are lost with the process
+    """
+    with timed(f'draw_{name}') as timer:
+        fig = (draw_graph if name == 'graph' else draw_fc)(*args)
+    fig.clear()
+    return name, timer.seconds
+
+
+def render_all(df_mess_: pd.DataFrame, fc_data: ForecastData, workers: int = 2,
+               graph_path: str = '/var/www/html/img/wetter3.jpg', fc_path: str = '/var/www/html/img/fc.jpg') -> None:
+    """
+    Renders all images. With more than one worker they are rendered in parallel processes, otherwise one after
+    another in this process reusing the figures of the previous call.
+    :param df_mess_: (30-min aggregated) data with temperature, zeit, pressure, hell
+    :param fc_data: prepared forecast
+    :param workers: number of worker processes
+    :param graph_path: path of the measurement/short-term forecast image
+    :param fc_path: path of the forecast image
+    :return: None
+    """
+    jobs = {'graph': (df_mess_, fc_data, graph_path), 'fc': (fc_data, fc_path)}
+    if workers > 1:
+        # computed once here, the cached results are pickled to the workers
+        _ = fc_data.mean, fc_data.ww
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+            futures = [pool.submit(_render, name, *args) for name, args in jobs.items()]
+            for future in futures:
+                name, seconds = future.result()
+                METRICS.observe(f'draw_{name}', seconds)
+                logging.info(f'{name} rendered in {seconds:.3f}s')
+        return
+    _FIGURES['graph'] = draw_graph(df_mess_, fc_data, graph_path, fig=_FIGURES.get('graph'))
+    _FIGURES['fc'] = draw_fc(fc_data, fc_path, fig=_FIGURES.get('fc'))
+
+
+def run(con_: 'mariadb.connection', workers: int = 1, output: str = cfg.GRAPH_OUTPUT) -> bool:
+    """
+    Loads the data and renders all images and/or exports the data for the browser charts.
+    :param con_: connection to MariaDB - Wetter
+    :param workers: number of render processes, see render_all
+    :param output: 'images', 'web' or 'both'
+    :return: True
+    """
+    df_mess, df_fc_raw, df_ww_codes = load_data(con_)
+    logging.info('data loaded from DB, preparing graphs')
+    fc_data = ForecastData(df_fc_raw, df_ww_codes)
+    if output in ('web', 'both'):
+        export_web(df_mess, fc_data, cfg.WEB_EXPORT_DIR)
+    if output in ('images', 'both'):
+        render_all(df_mess, fc_data, workers=workers)
+    return True
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Plots measurements and forecasts.')
+    parser.add_argument('--output', choices=['images', 'web', 'both'], default=cfg.GRAPH_OUTPUT,
+                        help='jpeg images, data for the browser charts or both')
+    args = parser.parse_args()
+
     logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
                         filename='/home/pi/logs/graph_wetter.log',
                         level=logging.INFO)
@@ -250,9 +502,7 @@ if __name__ == '__main__':
     logging.info('connected to MariaDB - wetter')
     # sleep(15)  # Wait until DB is updated...
 
-    # load
-    df_mess, df_fc_raw, df_ww_codes = load_data(con)
-    logging.info('data loaded from DB, preparing graphs')
-    _ = draw_graph(df_mess, df_fc_raw, df_ww_codes)
-    _ = draw_fc(df_fc_raw, df_ww_codes)
+    with profiled('weather_graph', cfg.PROFILE_DIR):
+        run(con, workers=cfg.RENDER_WORKERS, output=args.output)
+    METRICS.write_textfile(cfg.METRICS_DIR, 'weather_graph')
     logging.info('Script finished successfully')